@@ -0,0 +1,395 @@
+#!/usr/bin/python3
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from os import path
+
+import numpy as np
+import pandas as pd
+from bs4 import BeautifulSoup as bs
+
+import soccerprediction as sp
+from soccerprediction import scraping
+
+
+def roundrobin(teamcount):
+    # circle method fixture list, every team plays once per round and everyone meets home and away
+    teams = list(range(teamcount))
+    firsthalf = []
+    for r in range(teamcount - 1):
+        firsthalf += [(teams[i], teams[-1 - i]) if r % 2 else (teams[-1 - i], teams[i]) for i in range(teamcount // 2)]
+        teams.insert(1, teams.pop())
+    return firsthalf + [(a, h) for h, a in firsthalf]
+
+
+def makeresultspage(teamcount=20, season=2016, seed=0, extralinks=3000):
+    # build a results page laid out like the soccerpunter ones, so we can benchmark without going online
+    rng = np.random.RandomState(seed)
+    teams = ["Team " + str(t) for t in range(teamcount)]
+    startdate = datetime.date(season, 8, 1)
+
+    rows = ['<tr class="titleSpace"><td colspan="4"></td></tr>',
+            '<tr class="compHeading"><td colspan="4">Results</td></tr>']
+    for g, (h, a) in enumerate(roundrobin(teamcount)):
+        gamedate = startdate + datetime.timedelta(days=g // (teamcount // 2) * 3)
+        marker = " [ET]" if g % 97 == 0 else ""
+        rows.append('<tr class="{0}"><td><a href="#">{1}</a></td><td class="teamHome"><a href="#">{2}{3}</a></td>'
+                    '<td class="score"><a href="#">{4} - {5}</a></td><td class="teamAway"><a href="#">{6}</a></td>'
+                    '</tr>'.format("odd" if g % 2 else "even", gamedate.strftime("%d/%m/%Y"), teams[h], marker,
+                                   rng.poisson(1.5), rng.poisson(1.1), teams[a]))
+        rows.append('<tr class="matchEvents"><td colspan="4">Goals</td></tr>')
+
+    # real pages carry plenty of menus and other tables around the results, which the parser has to get through
+    sidebar = "".join('<li class="menuItem"><a href="/soccer-statistics/{0}">Competition {0}</a></li>'.format(l)
+                      for l in range(extralinks))
+    return ('<html><head><script>var x = 1;</script></head><body><ul class="sidebar">' + sidebar + '</ul>'
+            '<table class="competitionRanking">' + "".join(rows) + '</table></body></html>')
+
+
+def makeleague(teamcount=20, seasons=10, startseason=2010, seed=0):
+    # a league's worth of results in the same shape as scraped data, quicker to make than parsing pages
+    rng = np.random.RandomState(seed)
+    fixtures = roundrobin(teamcount)
+    games = len(fixtures)
+    frames = []
+    for season in range(startseason, startseason + seasons):
+        days = np.arange(games) // (teamcount // 2) * 3
+        frames.append(pd.DataFrame({"date": pd.Timestamp(season, 8, 1) + pd.to_timedelta(days, unit="D"),
+                                    "homeTeam": ["Team " + str(h) for h, a in fixtures],
+                                    "homeScore": rng.poisson(1.5, games),
+                                    "awayScore": rng.poisson(1.1, games),
+                                    "awayTeam": ["Team " + str(a) for h, a in fixtures],
+                                    "season": season}).sort_values(["date", "homeTeam"]))
+    return sp.settypes(pd.concat(frames, ignore_index=True))
+
+
+def legacyparse(content, season, today):
+    # the original parser, growing the dataframe one row at a time, kept to measure against
+    maintable = bs(content, "html.parser").find("table", "competitionRanking")
+    df = pd.DataFrame(columns=["date", "homeTeam", "homeScore", "awayScore", "awayTeam"])
+    for idx, game in enumerate(sp.parsegames(maintable.find_all("tr"), today)):
+        df.loc[idx] = {"date": game.date.strftime("%Y-%m-%d"),
+                       "homeTeam": game.homeTeam,
+                       "homeScore": game.homeScore,
+                       "awayScore": game.awayScore,
+                       "awayTeam": game.awayTeam}
+    df.sort_values(['date', 'homeTeam'], ascending=[True, True], inplace=True)
+    df.reset_index(inplace=True, drop=True)
+    df["season"] = season
+    return df
+
+
+def timeit(function, repeat):
+    # best of several runs, the least disturbed by whatever else the machine is doing
+    best = None
+    for r in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        taken = time.perf_counter() - started
+        best = taken if best is None else min(best, taken)
+    return best, result
+
+
+def benchparse(content, season, repeat, results):
+    today = datetime.date(season + 2, 1, 1)
+    legacytime, legacy = timeit(lambda: legacyparse(content, season, today), repeat)
+    streamtime, streamed = timeit(lambda: sp.parseseason(content, season, today), repeat)
+    results["parse.rowByRow"] = results.get("parse.rowByRow", 0) + legacytime
+    results["parse.streamed"] = results.get("parse.streamed", 0) + streamtime
+
+    # both parsers have to agree on every game before the timings mean anything
+    same = (legacy[["homeTeam", "awayTeam"]].values == streamed[["homeTeam", "awayTeam"]].astype(str).values).all()
+    same = same and (legacy["date"].values == streamed["date"].dt.strftime("%Y-%m-%d").values).all()
+    same = same and (legacy[["homeScore", "awayScore"]].values == streamed[["homeScore", "awayScore"]].values).all()
+
+    print("Parsed {0} games, outputs {1}".format(streamed.shape[0], "match" if same else "DIFFER"))
+    print("Row by row: {0:.3f}s  Streamed: {1:.3f}s  Speedup: {2:.2f}x".format(legacytime, streamtime,
+                                                                             legacytime / streamtime))
+
+
+def benchparsers(content, season, repeat, results):
+    today = datetime.date(season + 2, 1, 1)
+    megabytes = len(content.encode("utf-8")) / 1024 / 1024
+
+    # the whole page parse is the fallback, the fast paths must give exactly the same games
+    fulltime, full = timeit(lambda: sp.parseseason(content, season, today, fast=False), repeat)
+    results["parse.fullPage"] = results.get("parse.fullPage", 0) + fulltime
+    print("Full page html.parser: {0:.3f}s  {1:.2f} pages/s  {2:.2f} MB/s".format(fulltime, 1 / fulltime,
+                                                                                 megabytes / fulltime))
+
+    for parser in ["html.parser", "lxml"]:
+        try:
+            scraping.FASTPARSER, fastparser = parser, scraping.FASTPARSER
+            fasttime, fast = timeit(lambda: sp.parseseason(content, season, today), repeat)
+        except Exception as e:
+            print("Results table only {0}: unavailable ({1})".format(parser, e))
+            continue
+        finally:
+            scraping.FASTPARSER = fastparser
+
+        name = "parse.resultsTable." + parser
+        results[name] = results.get(name, 0) + fasttime
+        print("Results table only {0}: {1:.3f}s  {2:.2f} pages/s  {3:.2f} MB/s  Speedup: {4:.2f}x  Output {5}".format(
+            parser, fasttime, 1 / fasttime, megabytes / fasttime, fulltime / fasttime,
+            "matches" if fast.equals(full) else "DIFFERS"))
+
+
+def benchstorage(leaguecount, seasons, repeat, results):
+    leagues = [makeleague(seasons=seasons, seed=l) for l in range(leaguecount)]
+    lastseason = leagues[0]["season"].max()
+    print("Storage: {0} leagues of {1} seasons, {2} games".format(leaguecount, seasons,
+                                                                 sum(league.shape[0] for league in leagues)))
+
+    for storage in sorted(sp.STORAGE):
+        datapath = tempfile.mkdtemp() + "/"
+        try:
+            savetime, saved = timeit(lambda: [sp.savecompetition(league, "League", str(l), datapath, storage)
+                                              for l, league in enumerate(leagues)], repeat)
+            updatetime, updated = timeit(lambda: [sp.savecompetition(league, "League", str(l), datapath, storage,
+                                                                     [lastseason])
+                                                  for l, league in enumerate(leagues)], repeat)
+            loadtime, loaded = timeit(lambda: [sp.loadcompetition("League", str(l), datapath, storage)
+                                               for l in range(leaguecount)], repeat)
+        except ImportError as e:
+            print("{0}: unavailable ({1})".format(storage, e))
+            continue
+        finally:
+            shutil.rmtree(datapath)
+
+        same = all((a[["homeScore", "awayScore"]].values == b[["homeScore", "awayScore"]].values).all()
+                   for a, b in zip(leagues, loaded))
+        results["storage." + storage + ".saveAll"] = savetime
+        results["storage." + storage + ".saveSeason"] = updatetime
+        results["storage." + storage + ".load"] = loadtime
+        print("{0}: save all {1:.3f}s  save current season {2:.3f}s  load {3:.3f}s  Output {4}".format(
+            storage, savetime, updatetime, loadtime, "matches" if same else "DIFFERS"))
+
+
+# everything a prediction run imports, none of which should pull in the scraping libraries
+PREDICTIMPORTS = ("import soccerprediction.cli, soccerprediction.caches, soccerprediction.competitions, "
+                  "soccerprediction.model, soccerprediction.storage")
+
+
+def backtestleague(teamcount=20, seasons=10, seed=0):
+    # the backtests look at the games from a year ago, so move a league's seasons to have one playing then
+    # games from today on haven't been played yet
+    league = makeleague(teamcount, seasons, seed=seed)
+    today = pd.Timestamp(datetime.date.today())
+    lastseason = league.loc[league["season"] == league["season"].max(), "date"].min()
+    league["date"] = league["date"] + (today - pd.Timedelta(days=30) - lastseason)
+    league.loc[league["date"] >= today, ["homeScore", "awayScore"]] = -1
+    return league
+
+
+def benchpredict(leagues, history, repeat, results):
+    # predicting one date is the everyday run, a whole season is what the backtests and the server do in bulk
+    lastseason = [league.loc[(league["season"] == league["season"].max()) & (league["homeScore"] > -1)]
+                  for league in leagues]
+    singledates = [played["date"].iloc[-1] for played in lastseason]
+    seasondates = [list(played["date"].unique()) for played in lastseason]
+    games = sum(played.shape[0] for played in lastseason)
+    print("Predictions: {0} competitions, {1} games in their last seasons".format(len(leagues), games))
+
+    singletime, single = timeit(lambda: [sp.poissonpredict(league.copy(), gamedate, history)
+                                         for league, gamedate in zip(leagues, singledates)], repeat)
+    seasontime, season = timeit(lambda: [sp.batchpredict(league.copy(), dates, history)
+                                         for league, dates in zip(leagues, seasondates)], repeat)
+    indextime, indexed = timeit(lambda: [sp.batchpredict(league.copy(), dates, history,
+                                                         index=sp.buildstrengthindex(league))
+                                         for league, dates in zip(leagues, seasondates)], repeat)
+
+    # the strength index is only a quicker way of getting the same answers
+    same = all(np.allclose(a[sp.PREDICTIONCOLUMNS].values, b[sp.PREDICTIONCOLUMNS].values, equal_nan=True)
+               for a, b in zip(season, indexed))
+    results["predict.singleDate"] = singletime
+    results["predict.season"] = seasontime
+    results["predict.seasonIndexed"] = indextime
+    print("Single date: {0:.3f}s  Season: {1:.3f}s  Season from strength index: {2:.3f}s  {3:.0f} games/s  "
+          "Output {4}".format(singletime, seasontime, indextime, games / indextime, "matches" if same else "DIFFERS"))
+
+
+# how far apart the two modes may be, in percentage points for the probabilities and goals for totalGoals
+# 100,000 simulated games put the simulation within about 0.5 of a point and 0.03 goals nearly every time
+MODETOLERANCE = {"homeWin": 1.0, "draw": 1.0, "awayWin": 1.0, "totalGoals": 0.05, "threeOrMoreGoals": 1.0,
+                 "bothTeamsToScore": 1.0}
+
+
+def benchmodes(seed, repeat, results):
+    # the exact score matrix and the simulation should agree on every output, for strong and weak teams alike,
+    # with and without the low score correction
+    expected = np.array([0.3, 0.8, 1.3, 1.8, 2.5, 3.5])
+    homexg, awayxg = [grid.ravel() for grid in np.meshgrid(expected, expected, indexing="ij")]
+    within = True
+    for rho in [0.0, -0.1]:
+        analytictime, analytic = timeit(lambda: sp.poissonprobabilities(homexg, awayxg, mode="analytic", rho=rho),
+                                        repeat)
+        simulatedtime, simulated = timeit(lambda: sp.poissonprobabilities(homexg, awayxg, mode="montecarlo",
+                                                                          seed=seed, rho=rho), repeat)
+        differences = {column: np.max(np.abs(analytic[column] - simulated[column])) for column in sp.PREDICTIONCOLUMNS}
+        agree = all(differences[column] <= MODETOLERANCE[column] for column in sp.PREDICTIONCOLUMNS)
+        within = within and agree
+        name = "modes.rho{0:g}".format(rho)
+        results[name + ".analytic"] = analytictime
+        results[name + ".montecarlo"] = simulatedtime
+        print("Modes with rho {0:g}: {1} pairs, analytic {2:.4f}s, montecarlo {3:.3f}s, largest differences {4}  "
+              "{5}".format(rho, len(homexg), analytictime, simulatedtime,
+                           " ".join("{0} {1:.3f}".format(column, differences[column])
+                                    for column in sp.PREDICTIONCOLUMNS), "OK" if agree else "DIFFER"))
+    return within
+
+
+def benchbacktest(leagues, jobs, repeat, results):
+    # the full grid of history lengths and cutoffs that the backtest command searches
+    quiet = io.StringIO()
+    with contextlib.redirect_stdout(quiet):
+        testtime, tested = timeit(lambda: sp.runcompetitiontests(leagues, testdays=60, jobs=jobs), repeat)
+    results["backtest.runtests"] = testtime
+    print("Backtest: {0} competitions on {1} process(es): {2:.3f}s, {3} history and cutoff settings each".format(
+        len(leagues), jobs, testtime, tested[0].shape[0]))
+
+
+def benchstartup(budget, repeat, results):
+    # each check runs in a fresh interpreter so nothing is already imported, python starting on its own is taken off
+    checks = [("Python on its own", ["-c", "pass"]),
+              ("import soccerprediction", ["-c", "import soccerprediction"]),
+              ("soccerprediction --help", ["-m", "soccerprediction", "--help"]),
+              ("Prediction imports", ["-c", PREDICTIMPORTS]),
+              ("Scraping imports", ["-c", "import soccerprediction.scraping"])]
+    folder = path.dirname(path.abspath(__file__))
+    times = []
+    for name, arguments in checks:
+        taken, result = timeit(lambda: subprocess.run([sys.executable] + arguments, cwd=folder, check=True,
+                                                      stdout=subprocess.DEVNULL), repeat)
+        times.append(taken - times[0] if times else taken)
+        results["startup." + name] = times[-1]
+        print("{0}: {1:.3f}s".format(name, times[-1]))
+
+    # the command line has to start quickly, and predicting mustn't load anything only scraping needs
+    loaded = subprocess.run([sys.executable, "-c", PREDICTIMPORTS + "; import sys; print(' '.join("
+                             "m for m in ['requests', 'bs4', 'lxml', 'selenium'] if m in sys.modules))"],
+                            cwd=folder, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout.split()
+    within = times[2] <= budget and not loaded
+    print("Startup {0:.3f}s against a budget of {1:.3f}s, scraping libraries loaded for predictions: {2}  {3}".format(
+        times[2], budget, ", ".join(loaded) or "none", "OK" if within else "OVER BUDGET"))
+    return within
+
+
+def environment():
+    # timings only compare fairly between runs on the same machine and library versions
+    return {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+            "platform": platform.platform(), "processor": platform.processor(),
+            "date": datetime.date.today().isoformat()}
+
+
+def compare(results, baseline, tolerance):
+    # times against a previous run, anything slower by more than the tolerance counts as a regression
+    regressions = []
+    print("\n{0:<40} {1:>10} {2:>10} {3:>8}".format("Benchmark", "Baseline", "Now", "Change"))
+    for name in sorted(set(results) | set(baseline)):
+        if name not in results or name not in baseline:
+            print("{0:<40} {1:>10} {2:>10}".format(name, "{0:.4f}".format(baseline[name]) if name in baseline else "-",
+                                                   "{0:.4f}".format(results[name]) if name in results else "-"))
+            continue
+        change = (results[name] - baseline[name]) / baseline[name] * 100 if baseline[name] > 0 else 0
+        slower = change > tolerance * 100
+        if slower:
+            regressions.append(name)
+        print("{0:<40} {1:>10.4f} {2:>10.4f} {3:>+7.1f}%{4}".format(name, baseline[name], results[name], change,
+                                                                   "  SLOWER" if slower else ""))
+    return regressions
+
+
+BENCHMARKS = ["startup", "modes", "parse", "storage", "predict", "backtest"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS, help="Benchmarks to run")
+    parser.add_argument("--page", nargs="+", help="Saved results page(s) to benchmark instead of a generated one")
+    parser.add_argument("--season", default=2016, type=int, help="Season the results page is for")
+    parser.add_argument("--teams", default=20, type=int, help="Number of teams in each generated league and page")
+    parser.add_argument("--links", default=3000, type=int, help="Number of menu links around the generated results")
+    parser.add_argument("--leagues", default=50, type=int, help="Number of leagues for the storage benchmark")
+    parser.add_argument("--seasons", default=10, type=int, help="Number of seasons in each generated league")
+    parser.add_argument("--competitions", default=3, type=int,
+                        help="Number of leagues for the prediction and backtest benchmarks")
+    parser.add_argument("--history", default=100, type=int, help="History length for the prediction benchmark")
+    parser.add_argument("--jobs", default=1, type=int, help="Number of processes for the backtest benchmark")
+    parser.add_argument("--repeat", default=3, type=int, help="Number of times to repeat each timing")
+    parser.add_argument("--startupbudget", default=0.25, type=float,
+                        help="Seconds soccerprediction --help may take on top of starting python")
+    parser.add_argument("--startup", action="store_true", help="Only check the startup time, failing if over budget")
+    parser.add_argument("--modes", action="store_true",
+                        help="Only check the analytic and montecarlo modes agree, failing if they don't")
+    parser.add_argument("--seed", default=1, type=int, help="Random seed for the montecarlo side of the mode check")
+    parser.add_argument("--output", help="Save the timings to this json file")
+    parser.add_argument("--baseline", help="Compare against timings saved from an earlier run with --output")
+    parser.add_argument("--tolerance", default=0.1, type=float,
+                        help="How much slower than the baseline counts as a regression, 0.1 is 10%%")
+    args = parser.parse_args()
+
+    # every timing is the best of --repeat runs in seconds, kept by name so runs can be compared
+    results = {}
+    only = ["startup"] if args.startup else ["modes"] if args.modes else args.only
+    failed = []
+
+    if "startup" in only:
+        within = benchstartup(args.startupbudget, args.repeat, results)
+        if args.startup:
+            sys.exit(0 if within else 1)
+
+    # the two prediction modes disagreeing is a bug rather than a slowdown, so it always fails the run
+    if "modes" in only and not benchmodes(args.seed, args.repeat, results):
+        failed.append("modes")
+
+    if "parse" in only:
+        if args.page:
+            contents = []
+            for page in args.page:
+                with open(page, encoding="utf-8") as f:
+                    contents.append(f.read())
+        else:
+            contents = [makeresultspage(args.teams, args.season, extralinks=args.links)]
+
+        for content in contents:
+            benchparse(content, args.season, args.repeat, results)
+            benchparsers(content, args.season, args.repeat, results)
+
+    if "storage" in only:
+        benchstorage(args.leagues, args.seasons, args.repeat, results)
+
+    if "predict" in only or "backtest" in only:
+        leagues = [backtestleague(args.teams, args.seasons, seed=l) for l in range(args.competitions)]
+        if "predict" in only:
+            benchpredict(leagues, args.history, args.repeat, results)
+        if "backtest" in only:
+            benchbacktest(leagues, args.jobs, args.repeat, results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(), "settings": vars(args), "results": results}, f, indent=2,
+                      sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nSlower than the baseline:", ", ".join(regressions))
+            sys.exit(1)
+
+    if failed:
+        print("\nFailed checks:", ", ".join(failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
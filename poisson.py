@@ -1,6 +1,5 @@
 import pandas as pd
 from bs4 import BeautifulSoup as bs
-from selenium import webdriver
 import datetime
 from os import path
 import numpy as np
@@ -15,6 +14,8 @@ def scrapeseason(country, comp, season):
     print("")
 
     # scrape the page and create beautifulsoup object
+    # selenium is only needed to scrape, so it isn't imported until we do
+    from selenium import webdriver
     sess = webdriver.PhantomJS()
     sess.get(scrapeaddress)
     page = bs(sess.page_source, "lxml")
@@ -143,28 +144,29 @@ def poissonpredict(df, gamedate):
     return df
 
 
-if not path.isfile("data.csv"):
-    # set which country and competition we want to use
-    # others to try, "Scotland" & "Premiership" or "Europe" & "UEFA Champions League"
-    country = "England"
-    competition = "Premier League"
-    lastseason = 2016
-    thisseason = 2017
+if __name__ == "__main__":
+    if not path.isfile("data.csv"):
+        # set which country and competition we want to use
+        # others to try, "Scotland" & "Premiership" or "Europe" & "UEFA Champions League"
+        country = "England"
+        competition = "Premier League"
+        lastseason = 2016
+        thisseason = 2017
 
-    lastseasondata = scrapeseason(country, competition, lastseason)
-    thisseasondata = scrapeseason(country, competition, thisseason)
+        lastseasondata = scrapeseason(country, competition, lastseason)
+        thisseasondata = scrapeseason(country, competition, thisseason)
 
-    # combine our data to one frame
-    data = pd.concat([lastseasondata, thisseasondata])
-    data.reset_index(inplace=True, drop=True)
+        # combine our data to one frame
+        data = pd.concat([lastseasondata, thisseasondata])
+        data.reset_index(inplace=True, drop=True)
 
-    # save to file so we don't need to scrape multiple times
-    data.to_csv("data.csv")
-else:
-    # load our csv
-    data = pd.read_csv("data.csv", index_col=0, parse_dates=True)
+        # save to file so we don't need to scrape multiple times
+        data.to_csv("data.csv")
+    else:
+        # load our csv
+        data = pd.read_csv("data.csv", index_col=0, parse_dates=True)
 
-gamedate = datetime.date.today()
-data = poissonpredict(data, gamedate)
+    gamedate = datetime.date.today()
+    data = poissonpredict(data, gamedate)
 
-data.to_csv("data.csv")
\ No newline at end of file
+    data.to_csv("data.csv")
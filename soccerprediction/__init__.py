@@ -0,0 +1,44 @@
+import importlib
+
+# every public name and the module it lives in, modules are only imported the first time one of their names is used
+# so `import soccerprediction` stays quick and the scraping libraries aren't loaded unless we go online
+MODULES = {
+    "data": ["BASEURL", "MatchRecord", "PREDICTIONCOLUMNS", "settypes", "competitionfilename", "competitionkey",
+             "matchkeys", "datekeys"],
+    "teams": ["MARKERS", "cleanname", "namekey", "filelock", "TeamRegistry", "openregistry", "addteamids", "teamcodes"],
+    "caches": ["PageCache", "PredictionCache", "MatrixCache"],
+    "storage": ["STORAGE", "SQLITESCHEMA", "loadcsv", "savecsv", "seasonpartitions", "savearray", "loadparquet",
+                "saveparquet", "loadnumpy", "savenumpy", "opendatabase", "writesqlite", "sqliterows", "readsqlite",
+                "loadsqlite", "savesqlite", "savesqlitechanges", "storedcompetition", "loadcompetition",
+                "savecompetition"],
+    "competitions": ["getcompetitionsdata", "getcompetitiondata", "updatescores", "printupdates",
+                     "updatecompetitionsdata", "updatecompetitiondata"],
+    "model": ["poissonpmf", "poissonprobabilities", "teamstrengths", "expectedgoals", "runseed", "offsetseed",
+              "gameseeds", "rowhashes", "prefixsums", "buildstrengthindex", "indexwindow", "indexwindowhash",
+              "indexstrengths", "uncachedgames", "storepredictions", "batchpredict", "printpredictions",
+              "poissonpredict", "pairmatrix", "pairprediction", "competitionpairs"],
+    "dixoncoles": ["DECAY", "fitgames", "dixoncolesloss", "minimizebfgs", "fitdixoncoles", "fittedexpectedgoals",
+                   "dixoncolespredict", "dixoncolesgames"],
+    "backtest": ["DECAYS", "backtestpredictions", "backtestworker", "scorecutoffs", "runcompetitiontests",
+                 "runtests", "bestsettings", "confirmtests", "MARKETS", "RollingStrengths", "walkforward",
+                 "scoremarkets", "addscores", "scoretables", "runwalkforward"],
+    "season": ["CHUNKSIZE", "seasontable", "remainingexpectedgoals", "simulatechunks", "simulateseason",
+               "seasonsummary", "printseason"],
+    "scraping": ["FASTPARSER", "parsegames", "findresultstable", "parseseason", "HostRateLimiter", "makesession",
+                 "seasonurl", "fetchpage", "fetchpages", "scrapeseasons", "scrapeseason"],
+    "server": ["PredictionServer"],
+    "instrument": ["count", "timed", "snapshot", "merge", "poolworker", "report", "savereport"],
+}
+LOCATIONS = {name: module for module, names in MODULES.items() for name in names}
+
+__all__ = sorted(LOCATIONS)
+
+
+def __getattr__(name):
+    if name not in LOCATIONS:
+        raise AttributeError("module 'soccerprediction' has no attribute " + repr(name))
+    return getattr(importlib.import_module("." + LOCATIONS[name], __name__), name)
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,405 @@
+import datetime
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+from .data import datekeys
+from .instrument import count, merge, poolworker, timed
+from .model import batchpredict, buildstrengthindex, expectedgoals, offsetseed, poissonprobabilities
+from .teams import teamcodes
+
+# time decays tried for the fitted model, in place of history lengths
+DECAYS = [0.0005, 0.001, 0.0015, 0.0019, 0.0025, 0.003, 0.004, 0.005]
+
+# the markets scored by the walk forward test, result covers home, draw and away together
+MARKETS = ["result", "totalGoals", "threeOrMoreGoals", "bothTeamsToScore"]
+
+# the calibration tables group the predictions of each market given as a probability into this many equal bands
+CALIBRATIONMARKETS = ["homeWin", "draw", "awayWin", "threeOrMoreGoals", "bothTeamsToScore"]
+CALIBRATIONBINS = 10
+
+
+def backtestpredictions(data, startdate, testdays, histories, mode="analytic", seed=None, cache=None,
+                        competition="", model="poisson"):
+    # find every game with a result in the test window, rather than checking one day at a time
+    first = datekeys([startdate])[0]
+    gamedates = datekeys(data["date"])
+    intest = ((gamedates >= first) & (gamedates < first + np.timedelta64(testdays, "D")) &
+              (data["homeScore"] > -1).values)
+    testgames = data.loc[intest, ["date", "homeTeam", "awayTeam", "homeScore", "awayScore"]]
+    testdates = list(testgames["date"].unique())
+
+    # backtests are always repeatable, so results can be compared between runs, -s only picks another seed
+    if seed is None:
+        seed = 0
+
+    # the fitted model takes time decays rather than history lengths, they're kept in the history column so
+    # scoring works the same
+    if model == "dixoncoles":
+        from .dixoncoles import dixoncolespredict
+
+        predictions = []
+        for decay in histories:
+            # each date's fit starts from the one before, it needs every earlier game rather than just the test ones
+            predicted, fit = dixoncolespredict(data.loc[:, testgames.columns].copy(), testdates, decay, mode,
+                                               offsetseed(seed, int(round(decay * 1e6))), cache, competition)
+            predicted = predicted.loc[intest]
+            predicted.insert(0, "history", decay)
+            predictions.append(predicted)
+        return pd.concat(predictions)
+
+    # build the running team totals once, every history length and date is then answered from them
+    index = buildstrengthindex(data)
+
+    # predict the test games once for each history length, cutoffs only matter when scoring
+    predictions = []
+    for history in histories:
+        predicted = batchpredict(testgames.copy(), testdates, history, mode, offsetseed(seed, history), index, cache,
+                                 competition)
+        predicted.insert(0, "history", history)
+        predictions.append(predicted)
+
+    return pd.concat(predictions)
+
+
+def backtestworker(data, startdate, testdays, histories, mode, seed, cache=None, competition="", model="poisson"):
+    # runs in its own process, timing the cpu used for its share of the work so we can report the speedup
+    started = time.process_time()
+    predictions = backtestpredictions(data, startdate, testdays, histories, mode, seed, cache, competition, model)
+    return predictions, time.process_time() - started
+
+
+@timed("scoring")
+def scorecutoffs(predictions, cutoffs):
+    cutoffs = np.asarray(list(cutoffs))
+    count("scoring", "rows", predictions.shape[0])
+    homescore = predictions["homeScore"].values
+    awayscore = predictions["awayScore"].values
+    homewin = predictions["homeWin"].values
+    draw = predictions["draw"].values
+    awaywin = predictions["awayWin"].values
+
+    # the predicted result is whichever outcome is strictly the most likely, and the actual result must match it
+    drawpicked = (homescore == awayscore) & (draw > homewin) & (draw > awaywin)
+    homepicked = (homescore > awayscore) & (homewin > draw) & (homewin > awaywin)
+    awaypicked = (awayscore > homescore) & (awaywin > draw) & (awaywin > homewin)
+
+    # compare every game against every cutoff at once, giving a games x cutoffs table
+    correct = ((drawpicked[:, None] & (draw[:, None] >= cutoffs)) |
+               (homepicked[:, None] & (homewin[:, None] >= cutoffs)) |
+               (awaypicked[:, None] & (awaywin[:, None] >= cutoffs)))
+    betting = (draw[:, None] > cutoffs) | (homewin[:, None] > cutoffs) | (awaywin[:, None] > cutoffs)
+
+    # add up the games for each history length
+    history = predictions["history"].values
+    correct = pd.DataFrame(correct, columns=cutoffs).groupby(history).sum()
+    totalgames = pd.DataFrame(betting, columns=cutoffs).groupby(history).sum()
+    possiblegames = pd.Series(history).value_counts()
+
+    # lay the results out one row per cutoff and history
+    results = pd.DataFrame({"correct": correct.unstack(),
+                            "totalgames": totalgames.unstack()})
+    results.index.names = ["cutoff", "history"]
+    results["possiblegames"] = possiblegames.reindex(results.index.get_level_values("history")).values
+    results["score"] = (results["correct"] / results["totalgames"] * 100).fillna(0)
+    return results
+
+
+@timed("backtest")
+def runcompetitiontests(datasets, testdays=30, mode="analytic", seed=None, histories=range(25, 500, 25),
+                        cutoffs=range(40, 95, 5), jobs=1, cache=None, names=None, model="poisson"):
+    startdate = datetime.datetime.today() - datetime.timedelta(days=365)
+    if names is None:
+        names = [""] * len(datasets)
+
+    # split the history lengths (or decays) for every competition into one chunk per process
+    # a job count below 1 runs everything in this process, as 1 does
+    jobs = max(jobs, 1)
+    chunkcount = max(min(jobs, len(histories)), 1)
+    tasks = []
+    for data, name in zip(datasets, names):
+        for chunk in np.array_split(np.asarray(list(histories)), chunkcount):
+            chunk = [float(h) for h in chunk] if model == "dixoncoles" else [int(h) for h in chunk]
+            tasks.append((data, startdate, testdays, chunk, mode, seed, None, name, model))
+
+    # predict once per history length, spreading the chunks over the process pool if we have one
+    # the prediction cache lives in this process, so only a single process run can use it
+    started = time.time()
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            completed = []
+            for result, stages in executor.map(poolworker, repeat(backtestworker), *zip(*tasks)):
+                merge(stages)
+                completed.append(result)
+    else:
+        completed = [backtestworker(*task[:6], cache, *task[7:]) for task in tasks]
+    walltime = time.time() - started
+    worktime = sum(taken for predictions, taken in completed)
+    print("Backtest took {0:.2f}s on {1} process(es) for {2:.2f}s of work, speedup {3:.2f}x".format(
+        walltime, jobs, worktime, worktime / walltime if walltime > 0 else 1))
+
+    # results come back in the order the tasks were made, so merging them is deterministic
+    results = []
+    chunks = iter(completed)
+    for data in datasets:
+        predictions = pd.concat([next(chunks)[0] for c in range(chunkcount)])
+        results.append(scorecutoffs(predictions, cutoffs))
+
+    return results
+
+
+def runtests(data, testdays=30, mode="analytic", seed=None, histories=range(25, 500, 25), cutoffs=range(40, 95, 5),
+             jobs=1, cache=None, competition="", model="poisson"):
+    # score every cutoff against the same predictions, made once per history length
+    return runcompetitiontests([data], testdays, mode, seed, histories, cutoffs, jobs, cache, [competition],
+                               model)[0]
+
+
+def bestsettings(results, label="History"):
+    bestscore = 0
+    besthistory = 0
+    bestcutoff = 0
+    gamespredicted = 0
+
+    # work through the results in cutoff then history order, keeping the best score that bets on enough games
+    for (cutoff, history), correct, totalgames, possiblegames, score in results.itertuples():
+        if (score > bestscore or (
+                        score == bestscore and totalgames > gamespredicted)) and totalgames >= possiblegames / 10:
+            bestscore = score
+            besthistory = history
+            bestcutoff = cutoff
+            gamespredicted = totalgames
+            print("{0}:{1} Cutoff:{2:.2f} Score:{3:.2f}%".format(label, history, cutoff, score))
+            print("{0}/{1} results predicted correctly from {2} possible games".format(correct, totalgames,
+                                                                                       possiblegames))
+
+    return besthistory, bestcutoff, bestscore
+
+
+@timed("confirm")
+def confirmtests(data, history, cutoff, testdays=30, mode="analytic", seed=None, cache=None, competition="",
+                 model="poisson"):
+    startdate = datetime.datetime.today() - datetime.timedelta(days=365 - testdays)
+
+    predictions = backtestpredictions(data, startdate, testdays, [history], mode, seed, cache, competition, model)
+    scores = scorecutoffs(predictions, [cutoff])["score"]
+
+    # no results in the validation window gives nothing to score
+    return scores.iloc[0] if len(scores) > 0 else 0
+
+
+class RollingStrengths:
+    # home and away totals for every team over the last historylength games, kept up to date as results come in
+    # rather than worked out again for each date
+    def __init__(self, teams, historylength):
+        self.teams = teams
+        self.historylength = historylength
+        self.games = deque()
+        self.homeGoals = 0.0
+        self.awayGoals = 0.0
+        self.totals = {name: np.zeros(len(teams)) for name in ["homeGames", "homeFor", "homeAgainst", "awayGames",
+                                                               "awayFor", "awayAgainst"]}
+
+    def change(self, home, away, homescores, awayscores, sign):
+        # add games in, or take them out again with a sign of -1
+        self.homeGoals += sign * np.sum(homescores)
+        self.awayGoals += sign * np.sum(awayscores)
+        np.add.at(self.totals["homeGames"], home, sign)
+        np.add.at(self.totals["homeFor"], home, sign * homescores)
+        np.add.at(self.totals["homeAgainst"], home, sign * awayscores)
+        np.add.at(self.totals["awayGames"], away, sign)
+        np.add.at(self.totals["awayFor"], away, sign * awayscores)
+        np.add.at(self.totals["awayAgainst"], away, sign * homescores)
+
+    def add(self, home, away, homescores, awayscores):
+        # reveal some results, in the order they were played, the oldest games fall out of the window
+        self.change(home, away, homescores, awayscores, 1)
+        self.games.extend(zip(home, away, homescores, awayscores))
+        dropped = [self.games.popleft() for g in range(len(self.games) - self.historylength)]
+        if dropped:
+            self.change(*[np.array(column) for column in zip(*dropped)], -1)
+
+    def strengths(self):
+        # the same table indexstrengths gives for the window, teams with no games in it get NaN
+        games = len(self.games)
+        homeAvg = self.homeGoals / games if games > 0 else np.nan
+        awayAvg = self.awayGoals / games if games > 0 else np.nan
+        totals = self.totals
+        with np.errstate(divide="ignore", invalid="ignore"):
+            strengths = pd.DataFrame({"homeAttack": totals["homeFor"] / totals["homeGames"] / homeAvg,
+                                      "homeDefence": totals["homeAgainst"] / totals["homeGames"] / awayAvg,
+                                      "awayAttack": totals["awayFor"] / totals["awayGames"] / awayAvg,
+                                      "awayDefence": totals["awayAgainst"] / totals["awayGames"] / homeAvg},
+                                     index=self.teams)
+        return strengths, homeAvg, awayAvg
+
+
+def walkforward(data, startdate=None, enddate=None, historylength=100, mode="analytic", seed=None, model="poisson",
+                decay=None):
+    # predict each matchday from only the results before it, then reveal that day's results and move on
+    # a generator, so each day's predictions can be scored and written out before the next is made
+    played = data.loc[data["homeScore"] > -1, ["date", "homeTeam", "awayTeam", "homeScore", "awayScore"] +
+                      [column for column in ["homeTeamId", "awayTeamId"] if column in data]]
+    dates = datekeys(played["date"])
+    order = np.argsort(dates, kind="mergesort")
+    played = played.iloc[order]
+    dates = dates[order]
+
+    teams, home, away = teamcodes(played)
+    homescores = played["homeScore"].values.astype(float)
+    awayscores = played["awayScore"].values.astype(float)
+
+    # only the days that actually had games, from the date index rather than every day of the calendar
+    days = np.unique(dates)
+    if startdate is not None:
+        days = days[days >= datekeys([startdate])[0]]
+    if enddate is not None:
+        days = days[days <= datekeys([enddate])[0]]
+
+    if model == "dixoncoles":
+        from .dixoncoles import DECAY, fitdixoncoles, fittedexpectedgoals
+        decay = DECAY if decay is None else decay
+    rolling = RollingStrengths(teams, historylength)
+    revealed = 0
+    fit = None
+    for day in days:
+        first = np.searchsorted(dates, day, side="left")
+        last = np.searchsorted(dates, day, side="right")
+        games = played.iloc[first:last].copy()
+
+        if model == "dixoncoles":
+            # refit for the day, starting from the day before's ratings
+            fit = fitdixoncoles(data, day, decay, previous=fit)
+            homexg, awayxg = fittedexpectedgoals(fit, games["homeTeam"].values, games["awayTeam"].values)
+            rho = fit["rho"]
+        else:
+            # reveal every result since the last matchday, only the last historylength can still be in the window
+            start = max(revealed, first - historylength)
+            rolling.add(home[start:first], away[start:first], homescores[start:first], awayscores[start:first])
+            revealed = first
+            strengths, homeAvg, awayAvg = rolling.strengths()
+            homexg, awayxg = expectedgoals(strengths, homeAvg, awayAvg, games["homeTeam"].astype(str).values,
+                                           games["awayTeam"].astype(str).values)
+            rho = 0.0
+
+        # games with a team that has no history in the window (the first matchday, or a newly promoted side) can't
+        # be predicted, they're counted and left out rather than scored
+        predictable = np.isfinite(homexg) & np.isfinite(awayxg)
+        count("walkforward", "unpredicted", np.sum(~predictable))
+        if not np.any(predictable):
+            continue
+        games = games.loc[predictable]
+        homexg = homexg[predictable]
+        awayxg = awayxg[predictable]
+
+        prediction = poissonprobabilities(homexg, awayxg, mode=mode, seed=seed, rho=rho)
+        for column, values in prediction.items():
+            games[column] = values
+        count("walkforward", "rows", games.shape[0])
+        yield games
+
+
+@timed("marketScoring")
+def scoremarkets(predictions):
+    # brier score and log loss of every game in every market, lower is better for both
+    homescore = predictions["homeScore"].values.astype(float)
+    awayscore = predictions["awayScore"].values.astype(float)
+    totals = homescore + awayscore
+    scores = pd.DataFrame(index=predictions.index)
+
+    # home, draw and away together, the brier score adds up the squared misses of all three
+    outcomes = np.column_stack((homescore > awayscore, homescore == awayscore, homescore < awayscore))
+    probabilities = predictions[["homeWin", "draw", "awayWin"]].values / 100
+    scores["resultBrier"] = np.sum((probabilities - outcomes) ** 2, axis=1)
+    scores["resultLogLoss"] = -np.log(np.clip(np.sum(probabilities * outcomes, axis=1), 1e-15, 1))
+
+    # total goals is an expected number rather than a probability, so it's scored by its squared error and by the
+    # chance of the actual total under a poisson distribution with that mean
+    expected = np.clip(predictions["totalGoals"].values.astype(float), 1e-15, None)
+    logfactorials = np.concatenate(([0.0], np.cumsum(np.log(np.arange(1, totals.max() + 1)))))
+    scores["totalGoalsBrier"] = (expected - totals) ** 2
+    scores["totalGoalsLogLoss"] = expected - totals * np.log(expected) + logfactorials[totals.astype(int)]
+
+    # the yes/no markets
+    for market, outcome in [("threeOrMoreGoals", totals > 2), ("bothTeamsToScore", (homescore > 0) & (awayscore > 0))]:
+        probability = predictions[market].values / 100
+        scores[market + "Brier"] = (probability - outcome) ** 2
+        scores[market + "LogLoss"] = -np.log(np.clip(np.where(outcome, probability, 1 - probability), 1e-15, 1))
+    return scores
+
+
+def newtotals():
+    # running sums for the scores, and games, predicted chance and results for each calibration band
+    return {"games": 0,
+            "scores": dict.fromkeys([market + score for market in MARKETS for score in ["Brier", "LogLoss"]], 0.0),
+            "calibration": {market: np.zeros((3, CALIBRATIONBINS)) for market in CALIBRATIONMARKETS}}
+
+
+def addscores(totals, predictions, scores):
+    # add a day's scores onto the running totals, only sums are kept so the totals stay the same size
+    totals["games"] += predictions.shape[0]
+    for column in scores.columns:
+        totals["scores"][column] += scores[column].sum()
+
+    homescore = predictions["homeScore"].values
+    awayscore = predictions["awayScore"].values
+    outcomes = {"homeWin": homescore > awayscore,
+                "draw": homescore == awayscore,
+                "awayWin": homescore < awayscore,
+                "threeOrMoreGoals": homescore.astype(int) + awayscore > 2,
+                "bothTeamsToScore": (homescore > 0) & (awayscore > 0)}
+    for market in CALIBRATIONMARKETS:
+        probability = predictions[market].values / 100
+        bins = np.clip((probability * CALIBRATIONBINS).astype(int), 0, CALIBRATIONBINS - 1)
+        calibration = totals["calibration"][market]
+        calibration[0] += np.bincount(bins, minlength=CALIBRATIONBINS)
+        calibration[1] += np.bincount(bins, probability, CALIBRATIONBINS)
+        calibration[2] += np.bincount(bins, outcomes[market], CALIBRATIONBINS)
+    return totals
+
+
+def scoretables(totals):
+    # the mean brier score and log loss for each market, and how often each band of predictions came true
+    games = totals["games"]
+    summary = pd.DataFrame({"games": games,
+                            "brier": [totals["scores"][market + "Brier"] / games if games else np.nan
+                                      for market in MARKETS],
+                            "logLoss": [totals["scores"][market + "LogLoss"] / games if games else np.nan
+                                        for market in MARKETS]},
+                           index=pd.Index(MARKETS, name="market"))
+
+    rows = []
+    for market in CALIBRATIONMARKETS:
+        calibration = totals["calibration"][market]
+        for b in range(CALIBRATIONBINS):
+            if calibration[0, b] > 0:
+                rows.append((market, "{0}-{1}%".format(b * 100 // CALIBRATIONBINS, (b + 1) * 100 // CALIBRATIONBINS),
+                             int(calibration[0, b]), calibration[1, b] / calibration[0, b] * 100,
+                             calibration[2, b] / calibration[0, b] * 100))
+    calibration = pd.DataFrame(rows, columns=["market", "band", "games", "predicted", "observed"])
+    return summary, calibration
+
+
+@timed("walkforward")
+def runwalkforward(datasets, names, startdate=None, enddate=None, historylength=100, mode="analytic", seed=None,
+                   model="poisson", decay=None, output=None):
+    # walk forward through every competition, writing each matchday out as soon as it's scored so only the running
+    # totals are kept however many seasons and competitions are tested
+    results = []
+    header = True
+    for data, name in zip(datasets, names):
+        totals = newtotals()
+        for predictions in walkforward(data, startdate, enddate, historylength, mode, seed, model, decay):
+            scores = scoremarkets(predictions)
+            addscores(totals, predictions, scores)
+            if output is not None:
+                day = pd.concat([predictions, scores], axis=1)
+                day.insert(0, "competition", name)
+                day.to_csv(output, mode="w" if header else "a", header=header, index=False)
+                header = False
+        results.append(scoretables(totals))
+    return results
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from os import getpid, path, makedirs, remove, replace
+
+from .data import PREDICTIONCOLUMNS
+
+
+class PageCache:
+    # raw html of downloaded pages, kept on disk with the headers needed to ask the site if a page has changed
+    def __init__(self, cachepath, maxsize=100 * 1024 * 1024, refresh=False):
+        self.cachepath = cachepath
+        self.maxsize = maxsize
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.indexfile = path.join(cachepath, "index.json")
+
+        if not path.exists(cachepath):
+            makedirs(cachepath)
+        if path.isfile(self.indexfile):
+            with open(self.indexfile) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+
+    def headers(self, url):
+        # ask the site to only send the page if it has changed since we saved it
+        entry = self.index.get(url)
+        if self.refresh or entry is None:
+            return {}
+        headers = {}
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["lastModified"]:
+            headers["If-Modified-Since"] = entry["lastModified"]
+        return headers
+
+    def get(self, url):
+        with self.lock:
+            entry = self.index[url]
+            entry["used"] = time.time()
+        with open(path.join(self.cachepath, entry["file"]), encoding="utf-8") as f:
+            return f.read()
+
+    def store(self, url, content, etag, lastmodified):
+        # returns whether the page is new or different to the one we had, a forced refresh counts as changed
+        contenthash = hashlib.sha1(content.encode("utf-8")).hexdigest()
+        filename = hashlib.sha1(url.encode("utf-8")).hexdigest() + ".html"
+        with self.lock:
+            changed = self.refresh or url not in self.index or self.index[url]["hash"] != contenthash
+            if changed:
+                with open(path.join(self.cachepath, filename), "w", encoding="utf-8") as f:
+                    f.write(content)
+            self.index[url] = {"file": filename, "etag": etag, "lastModified": lastmodified, "hash": contenthash,
+                               "size": len(content), "used": time.time()}
+            self.evict()
+        return changed
+
+    def evict(self):
+        # throw away the least recently used pages until we're back under the size limit
+        total = sum(entry["size"] for entry in self.index.values())
+        for url in sorted(self.index, key=lambda u: self.index[u]["used"]):
+            if total <= self.maxsize:
+                break
+            entry = self.index.pop(url)
+            total -= entry["size"]
+            filename = path.join(self.cachepath, entry["file"])
+            if path.isfile(filename):
+                remove(filename)
+
+    def save(self):
+        # written to a file of our own then moved into place, so other processes never see a half written index
+        with self.lock:
+            self.evict()
+            temporary = self.indexfile + "." + str(getpid()) + ".tmp"
+            with open(temporary, "w") as f:
+                json.dump(self.index, f, indent=1)
+            replace(temporary, self.indexfile)
+
+
+class PredictionCache:
+    # predictions we've already worked out, keyed on everything that goes into them
+    # held in memory with the least recently used dropped first, and optionally on disk so later runs can use them
+    def __init__(self, maxentries=100000, filename=None):
+        self.entries = OrderedDict()
+        self.maxentries = maxentries
+        self.hits = 0
+        self.misses = 0
+        self.connection = None
+
+        if filename is not None:
+            self.connection = sqlite3.connect(filename, timeout=60, isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS predictioncache (key TEXT PRIMARY KEY, "
+                                    "competition TEXT, date TEXT, " +
+                                    ", ".join(column + " REAL" for column in PREDICTIONCOLUMNS) + ")")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS predictioncacheDate "
+                                    "ON predictioncache (competition, date)")
+
+    @staticmethod
+    def key(competition, gamedate, hometeam, awayteam, historylength, mode, seed, windowhash):
+        # windowhash identifies the exact games used as history, so a changed result can never give a stale hit
+        return (competition, str(gamedate), str(hometeam), str(awayteam), int(historylength), mode, seed,
+                int(windowhash))
+
+    def remember(self, key, values):
+        self.entries[key] = values
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxentries:
+            self.entries.popitem(last=False)
+
+    def get(self, key):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        if self.connection is not None:
+            row = self.connection.execute("SELECT " + ", ".join(PREDICTIONCOLUMNS) + " FROM predictioncache "
+                                          "WHERE key = ?", ["|".join(map(str, key))]).fetchone()
+            if row is not None:
+                self.hits += 1
+                self.remember(key, row)
+                return row
+
+        self.misses += 1
+        return None
+
+    def putmany(self, keys, values):
+        for key, value in zip(keys, values):
+            self.remember(key, value)
+
+        if self.connection is not None:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.executemany("INSERT OR REPLACE INTO predictioncache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                        [("|".join(map(str, key)), key[0], key[1]) + tuple(value)
+                                         for key, value in zip(keys, values)])
+            self.connection.execute("COMMIT")
+
+    def invalidate(self, competition, fromdate):
+        # a changed result on fromdate can be in the history of any game after it
+        fromdate = str(fromdate)
+        for key in [k for k in self.entries if k[0] == competition and k[1] > fromdate]:
+            del self.entries[key]
+        if self.connection is not None:
+            self.connection.execute("DELETE FROM predictioncache WHERE competition = ? AND date > ?",
+                                    [competition, fromdate])
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+
+class MatrixCache:
+    # all-pairs prediction tables, which are large, so only a few are kept with the least recently used dropped first
+    def __init__(self, maxentries=16):
+        self.entries = OrderedDict()
+        self.maxentries = maxentries
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(windows, mode, seed):
+        # windows holds the competition, date, history length and window hash of every competition in the table
+        return (tuple((competition, str(gamedate), int(historylength), int(windowhash))
+                      for competition, gamedate, historylength, windowhash in windows), mode, seed)
+
+    def get(self, key):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, matrix):
+        self.entries[key] = matrix
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxentries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
@@ -0,0 +1,335 @@
+import argparse
+import datetime
+from os import path, makedirs
+
+# only the argument parsing is imported up front, each command imports what it needs when it runs
+COMMANDS = ["predict", "update", "backtest", "walkforward", "simulate", "serve"]
+
+
+def addcompetitionarguments(parser):
+    # every command works on one or more competitions from the same data folder
+    parser.add_argument("-c", "--country", default="England", help="Country to read data for")
+    parser.add_argument("-l", "--league", default="Premier League", help="Competition/League to read data for")
+    parser.add_argument("-o", "--competitions", nargs="+", metavar="COUNTRY:LEAGUE",
+                        help="Several competitions to use instead of -c and -l, eg \"Scotland:Premiership\"")
+    parser.add_argument("-p", "--path", default="data/", help="Path to store data files")
+    parser.add_argument("-f", "--storage", default="numpy", choices=["csv", "numpy", "parquet", "sqlite"],
+                        help="Format to store data in, existing csv files are converted automatically")
+    parser.add_argument("-m", "--mode", default="analytic", choices=["analytic", "montecarlo"],
+                        help="Calculate probabilities exactly (analytic) or by simulating games (montecarlo)")
+    parser.add_argument("-s", "--seed", default=None, type=int,
+                        help="Random seed for montecarlo mode and simulate, backtest uses 0 without one")
+
+
+def addmodelarguments(parser):
+    # the original model averages each team's recent games, the fitted one rates every team from all its games
+    parser.add_argument("--model", default="poisson", choices=["poisson", "dixoncoles"],
+                        help="Predict from recent averages (poisson) or fitted team ratings (dixoncoles)")
+
+
+def adddownloadarguments(parser):
+    # anything we don't have yet has to be downloaded first
+    parser.add_argument("-n", "--connections", default=4, type=int, help="Number of pages to download at once")
+    parser.add_argument("--baseurl", default=None, help="Site to download results pages from")
+    parser.add_argument("-r", "--refresh", action="store_true", help="Download pages even if they haven't changed")
+    parser.add_argument("--cachesize", default=100, type=int, help="Size limit of the page cache in MB")
+
+
+def addprofilearguments(parser):
+    parser.add_argument("--profile", metavar="FILE",
+                        help="Save the time, rows and cache hits of each stage as json, - prints it instead")
+    parser.add_argument("--cprofile", metavar="FILE", help="Also save a cProfile of the whole run, for pstats")
+
+
+def makeparser():
+    todaysdate = datetime.date.today().strftime("%Y-%m-%d")
+
+    parser = argparse.ArgumentParser(prog="soccerprediction")
+    commands = parser.add_subparsers(dest="command", metavar="{" + ",".join(COMMANDS) + "}")
+
+    predict = commands.add_parser("predict", help="Predict the games on one or more dates (the default)")
+    addcompetitionarguments(predict)
+    adddownloadarguments(predict)
+    addprofilearguments(predict)
+    predict.add_argument("-u", "--update", action="store_true", help="Update with latest scores first")
+    predict.add_argument("-d", "--date", default=[todaysdate], nargs="+",
+                         help="Date(s) of games to predict YYYY-MM-DD, eg 2017-09-20 2017-09-23")
+    addmodelarguments(predict)
+    predict.add_argument("-y", "--history", default=100, type=int, help="Number of historical games to consider")
+    predict.add_argument("--decay", default=None, type=float,
+                         help="Weight lost per day of age by games in the dixoncoles fit, used instead of -y")
+    predict.add_argument("-b", "--cutoff", default=-1, type=int, help="Cutoff probability for betting")
+    predict.add_argument("-k", "--keeppredictions", action="store_true",
+                         help="Keep predictions on disk so later runs can reuse them")
+    predict.add_argument("-e", "--export", action="store_true", help="Also save the data as csv files")
+
+    update = commands.add_parser("update", help="Update with latest scores")
+    addcompetitionarguments(update)
+    adddownloadarguments(update)
+    addprofilearguments(update)
+    update.add_argument("-k", "--keeppredictions", action="store_true",
+                        help="Drop kept predictions that the new scores have made out of date")
+    update.add_argument("-e", "--export", action="store_true", help="Also save the data as csv files")
+
+    backtest = commands.add_parser("backtest", help="Run tests to find best history length and cutoff values")
+    addcompetitionarguments(backtest)
+    adddownloadarguments(backtest)
+    addprofilearguments(backtest)
+    backtest.add_argument("-u", "--update", action="store_true", help="Update with latest scores first")
+    backtest.add_argument("-j", "--jobs", default=1, type=int, help="Number of processes to run tests with")
+    backtest.add_argument("-k", "--keeppredictions", action="store_true",
+                          help="Keep predictions on disk so later runs can reuse them")
+    addmodelarguments(backtest)
+
+    walk = commands.add_parser("walkforward", help="Predict every past matchday from only the results before it and "
+                                                   "score every market")
+    addcompetitionarguments(walk)
+    adddownloadarguments(walk)
+    addprofilearguments(walk)
+    addmodelarguments(walk)
+    walk.add_argument("-u", "--update", action="store_true", help="Update with latest scores first")
+    walk.add_argument("--start", default=None, help="First date to test YYYY-MM-DD, the start of the data if not given")
+    walk.add_argument("--end", default=None, help="Last date to test YYYY-MM-DD, the latest results if not given")
+    walk.add_argument("-y", "--history", default=100, type=int, help="Number of historical games to consider")
+    walk.add_argument("--decay", default=None, type=float,
+                      help="Weight lost per day of age by games in the dixoncoles fit, used instead of -y")
+    walk.add_argument("-x", "--output", metavar="FILE",
+                      help="Save every game's predictions and scores as csv, written as the test goes")
+
+    simulate = commands.add_parser("simulate", help="Simulate the rest of the season to project the final table")
+    addcompetitionarguments(simulate)
+    adddownloadarguments(simulate)
+    addprofilearguments(simulate)
+    simulate.add_argument("-u", "--update", action="store_true", help="Update with latest scores first")
+    simulate.add_argument("-y", "--history", default=100, type=int, help="Number of historical games to consider")
+    simulate.add_argument("-t", "--simulations", default=100000, type=int, help="Number of seasons to simulate")
+    simulate.add_argument("--chunksize", default=5000, type=int,
+                          help="Seasons simulated at a time, memory use depends on this rather than -t")
+    simulate.add_argument("-j", "--jobs", default=1, type=int, help="Number of processes to simulate with")
+    simulate.add_argument("--relegation", default=3, type=int, help="Number of places relegated")
+    simulate.add_argument("-x", "--output", metavar="FILE", help="Also save every position's probability as csv")
+
+    serve = commands.add_parser("serve", help="Answer predictions over HTTP with the data kept loaded")
+    addcompetitionarguments(serve)
+    adddownloadarguments(serve)
+    addprofilearguments(serve)
+    serve.add_argument("-y", "--history", default=100, type=int,
+                       help="Default number of historical games to consider")
+    serve.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    serve.add_argument("--port", default=8080, type=int, help="Port to listen on")
+    serve.add_argument("-i", "--interval", default=60, type=int,
+                       help="Seconds between checks for newly saved results, 0 to only reload on /reload")
+    return parser
+
+
+def competitionlist(args):
+    if args.competitions:
+        return [c.split(":", 1) for c in args.competitions]
+    return [(args.country, args.league)]
+
+
+def opencaches(args):
+    from .caches import PageCache, PredictionCache
+
+    # downloaded pages are kept alongside our data, so unchanged pages don't need downloading or parsing again
+    makedirs(args.path, exist_ok=True)
+    cache = PageCache(path.join(args.path, "cache"), args.cachesize * 1024 * 1024, args.refresh)
+
+    # predictions are remembered by the games they were made from, optionally on disk for the next run
+    keep = getattr(args, "keeppredictions", False)
+    predictioncache = PredictionCache(filename=path.join(args.path, "predictions.sqlite") if keep else None)
+    return cache, predictioncache
+
+
+def loaddatasets(args, competitions, cache, predictioncache, window=None):
+    from .competitions import getcompetitionsdata, updatecompetitionsdata
+    from .data import BASEURL
+
+    baseurl = args.baseurl or BASEURL
+    if getattr(args, "update", False) or args.command == "update":
+        return updatecompetitionsdata(competitions, 2014, args.path, baseurl, args.connections, cache, args.storage,
+                                      predictioncache)
+    return getcompetitionsdata(competitions, 2014, args.path, baseurl, args.connections, cache, args.storage,
+                               window=window)
+
+
+def export(args, competitions, datasets):
+    from .data import competitionfilename
+    from .storage import loadcompetition, savecsv
+
+    for (country, competition), data in zip(competitions, datasets):
+        # sqlite may only have given us part of the data, so fetch all of it to export
+        if args.storage == "sqlite":
+            data = loadcompetition(country, competition, args.path, args.storage)
+        savecsv(data, competitionfilename(country, competition, args.path))
+
+
+def predictcommand(args):
+    import numpy as np
+    from .data import competitionkey, datekeys
+    from .model import poissonpredict
+    from .storage import savecompetition
+
+    competitions = competitionlist(args)
+    cache, predictioncache = opencaches(args)
+    gamedates = args.date
+
+    # poisson predictions only need the recent history, which sqlite can fetch on its own
+    # the fitted model weights every earlier game, so it needs them all
+    window = (gamedates, args.history) if args.model == "poisson" else None
+    datasets = loaddatasets(args, competitions, cache, predictioncache, window=window)
+
+    for c, (country, competition) in enumerate(competitions):
+        # do the prediction - now takes number of historical games to use rather than using everything
+        # added cutoff option which will printout game predictions with a probability higher than the cutoff
+        name = competitionkey(country, competition)
+        if args.model == "dixoncoles":
+            from .dixoncoles import DECAY, dixoncolesgames
+            decay = DECAY if args.decay is None else args.decay
+            data = datasets[c] = dixoncolesgames(datasets[c], gamedates, decay, args.cutoff, args.mode, args.seed,
+                                                 cache=predictioncache, competition=name)
+        else:
+            data = datasets[c] = poissonpredict(datasets[c], gamedates, args.history, args.cutoff, args.mode,
+                                                args.seed, cache=predictioncache, competition=name)
+
+        # save our predictions, only the seasons we predicted games in need saving
+        predicted = data.loc[np.isin(datekeys(data["date"]), datekeys(gamedates)), "season"].unique()
+        savecompetition(data, country, competition, args.path, args.storage, predicted)
+
+    if args.export:
+        export(args, competitions, datasets)
+
+    print("Prediction cache: {hits} hits, {misses} misses".format(**predictioncache.stats()))
+
+
+def updatecommand(args):
+    competitions = competitionlist(args)
+    cache, predictioncache = opencaches(args)
+    datasets = loaddatasets(args, competitions, cache, predictioncache)
+
+    if args.export:
+        export(args, competitions, datasets)
+
+
+def backtestcommand(args):
+    from .backtest import DECAYS, bestsettings, confirmtests, runcompetitiontests
+    from .data import competitionkey
+
+    competitions = competitionlist(args)
+    cache, predictioncache = opencaches(args)
+    datasets = loaddatasets(args, competitions, cache, predictioncache)
+    names = [competitionkey(country, comp) for country, comp in competitions]
+
+    # the fitted model is tested over time decays, the original one over history lengths
+    if args.model == "dixoncoles":
+        settings = {"histories": DECAYS}
+        label, option = "Decay", "--model dixoncoles --decay"
+    else:
+        settings = {}
+        label, option = "History", "-y"
+
+    # every competition is tested in the same process pool so all the cores stay busy
+    allresults = runcompetitiontests(datasets, testdays=60, mode=args.mode, seed=args.seed, jobs=args.jobs,
+                                     cache=predictioncache, names=names, model=args.model, **settings)
+
+    for (country, competition), name, data, results in zip(competitions, names, datasets, allresults):
+        print("\n" + country, competition)
+        besthistory, bestcutoff, bestscore = bestsettings(results, label)
+        print("Score of {0:.2f}% with {1} setting of {2} and cutoff of {3}".format(bestscore, label.lower(),
+                                                                                 besthistory, bestcutoff))
+        confirmscore = confirmtests(data, besthistory, bestcutoff, testdays=60, mode=args.mode, seed=args.seed,
+                                    cache=predictioncache, competition=name, model=args.model)
+        print("Validation score of {0:.2f}%".format(confirmscore))
+
+        print("If the above scores seem acceptable, you should use these options")
+        print("python -m soccerprediction predict -c \"{0}\" -l \"{1}\" {2} {3} -b {4}".format(
+            country, competition, option, besthistory, bestcutoff))
+    print("\nGood Luck!")
+    print("Prediction cache: {hits} hits, {misses} misses".format(**predictioncache.stats()))
+
+
+def walkforwardcommand(args):
+    from .backtest import runwalkforward
+    from .data import competitionkey
+
+    competitions = competitionlist(args)
+    cache, predictioncache = opencaches(args)
+    datasets = loaddatasets(args, competitions, cache, predictioncache)
+    names = [competitionkey(country, comp) for country, comp in competitions]
+
+    results = runwalkforward(datasets, names, args.start, args.end, args.history, args.mode, args.seed, args.model,
+                             args.decay, args.output)
+    for (country, competition), (summary, calibration) in zip(competitions, results):
+        print("\n" + country, competition)
+        print(summary.to_string(float_format="{0:.4f}".format))
+        print("\nPredicted against actual for each band of probability")
+        print(calibration.to_string(index=False, float_format="{0:.1f}".format))
+
+
+def simulatecommand(args):
+    from .season import printseason, seasonsummary, simulateseason
+
+    competitions = competitionlist(args)
+    cache, predictioncache = opencaches(args)
+    datasets = loaddatasets(args, competitions, cache, predictioncache)
+
+    summaries = []
+    for (country, competition), data in zip(competitions, datasets):
+        result = simulateseason(data, args.history, args.simulations, args.chunksize, args.seed, args.jobs)
+        summary = seasonsummary(result, args.relegation)
+        print("\n{0} {1} {2}: {3} games left, {4} simulations".format(country, competition, result["season"],
+                                                                       result["fixtures"], result["simulations"]))
+        printseason(summary)
+        summary.insert(0, "competition", country + ":" + competition)
+        summaries.append(summary)
+
+    if args.output:
+        import pandas as pd
+        pd.concat(summaries).to_csv(args.output, index=False)
+
+
+def servecommand(args):
+    import asyncio
+    from .data import BASEURL
+    from .server import PredictionServer
+
+    server = PredictionServer(competitionlist(args), args.path, args.storage, args.history, args.mode, args.seed,
+                              args.baseurl or BASEURL, args.connections)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.interval))
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    import sys
+
+    # predicting is what we do most, so it's the command when none is given
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ["-h", "--help"]):
+        argv = ["predict"] + argv
+
+    args = makeparser().parse_args(argv)
+    command = {"predict": predictcommand,
+               "update": updatecommand,
+               "backtest": backtestcommand,
+               "walkforward": walkforwardcommand,
+               "simulate": simulatecommand,
+               "serve": servecommand}[args.command]
+
+    # the stage timings are always kept, cProfile slows everything down so it only runs when asked for
+    from .instrument import reset
+    reset()
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(command, args)
+        finally:
+            profiler.dump_stats(args.cprofile)
+    else:
+        command(args)
+
+    if args.profile:
+        from .instrument import savereport
+        savereport(args.profile, command=args.command)
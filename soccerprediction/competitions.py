@@ -0,0 +1,180 @@
+import datetime
+from os import path, makedirs
+
+import numpy as np
+import pandas as pd
+
+from .data import BASEURL, competitionkey, datekeys, matchkeys, settypes
+from .instrument import count, timed
+from .storage import loadcompetition, savecompetition, savesqlitechanges
+from .teams import addteamids, openregistry
+
+
+@timed("load", countrows=True)
+def getcompetitionsdata(competitions, startseason, datapath, baseurl=BASEURL, connections=4, cache=None,
+                        storage="numpy", window=None, registry=None):
+    # make sure our datapath exists
+    if not path.exists(datapath):
+        makedirs(datapath)
+
+    # every team gets the same id in every competition and season, however the site spells it
+    if registry is None:
+        registry = openregistry(datapath)
+
+    # load what we already have, data saved before we had ids (or in sqlite, which doesn't keep them) gets them now
+    datasets = [loadcompetition(country, comp, datapath, storage, window) for country, comp in competitions]
+    datasets = [None if data is None else addteamids(data, registry) for data in datasets]
+
+    # gather every season of every competition we don't have yet, so they can all be downloaded together
+    currentseason = datetime.date.today().year
+    missing = [competition for competition, data in zip(competitions, datasets) if data is None]
+    seasons = [(country, comp, s) for country, comp in missing for s in range(startseason, currentseason + 1)]
+    scraped = None
+    if seasons:
+        # the scraping libraries are only imported when there is something to download
+        from .scraping import scrapeseasons
+        scraped = iter(scrapeseasons(seasons, baseurl, connections, cache=cache))
+
+    for c, (country, comp) in enumerate(competitions):
+        if datasets[c] is None:
+            # combine our data to one frame, the team categories are merged across seasons
+            seasondata = [next(scraped) for s in range(startseason, currentseason + 1)]
+            data = addteamids(settypes(pd.concat(seasondata)), registry)
+            data.reset_index(inplace=True, drop=True)
+
+            # save to file so we don't need to scrape multiple times
+            savecompetition(data, country, comp, datapath, storage)
+            datasets[c] = data
+
+    # the pages we downloaded are only marked as seen now their games are saved
+    if cache is not None:
+        cache.save()
+    return datasets
+
+
+def getcompetitiondata(country, comp, startseason, datapath, baseurl=BASEURL, connections=4, cache=None,
+                       storage="numpy"):
+    return getcompetitionsdata([(country, comp)], startseason, datapath, baseurl, connections, cache, storage)[0]
+
+
+def updatescores(currentdata, latestdata):
+    today = np.datetime64(datetime.date.today(), "D")
+    current = matchkeys(currentdata)
+    current["row"] = currentdata.index
+    latest = matchkeys(latestdata)
+    latest["homeScore"] = latestdata["homeScore"].values
+    latest["awayScore"] = latestdata["awayScore"].values
+    latest["season"] = latestdata["season"].values
+    latest = latest.drop_duplicates(["date", "homeTeam"], keep="last")
+
+    # join every game we have with the latest copy of the same date and home team in one go
+    joined = current.merge(latest, on=["date", "homeTeam"], how="outer", suffixes=("", "Latest"), indicator=True)
+    matched = joined.loc[joined["_merge"] == "both"].astype({"row": int})
+
+    # store any new or corrected scores
+    changed = matched.loc[(matched["homeScore"] > -1) &
+                          ((currentdata.loc[matched["row"], "homeScore"].values != matched["homeScore"].values) |
+                           (currentdata.loc[matched["row"], "awayScore"].values != matched["awayScore"].values))]
+    currentdata.loc[changed["row"].values, "homeScore"] = changed["homeScore"].values
+    currentdata.loc[changed["row"].values, "awayScore"] = changed["awayScore"].values
+
+    # games without a result that are no longer on that date may have been moved, look for the same teams elsewhere
+    # in the same season, an old fixture that was never played isn't the same game as next season's
+    unmatched = joined.loc[joined["_merge"] == "left_only"].astype({"row": int})
+    unmatched = unmatched.loc[currentdata.loc[unmatched["row"], "homeScore"].values < 0]
+    unmatched["season"] = currentdata.loc[unmatched["row"], "season"].values.astype(int)
+    newgames = joined.loc[joined["_merge"] == "right_only"].drop(columns=["awayTeam", "row", "_merge"])
+    newgames = newgames.rename(columns={"awayTeamLatest": "awayTeam"}).astype({"season": int})
+    moved = unmatched[["row", "date", "homeTeam", "awayTeam", "season"]].rename(columns={"date": "oldDate"}).merge(
+        newgames.drop_duplicates(["homeTeam", "awayTeam", "season"]), on=["homeTeam", "awayTeam", "season"])
+    currentdata.loc[moved["row"].values, "date"] = moved["date"].values
+    currentdata.loc[moved["row"].values, "season"] = moved["season"].values.astype(currentdata["season"].dtype)
+    currentdata.loc[moved["row"].values, "homeScore"] = moved["homeScore"].values
+    currentdata.loc[moved["row"].values, "awayScore"] = moved["awayScore"].values
+
+    # anything else in the latest data is a game we've never seen, add it
+    added = newgames.merge(moved[["date", "homeTeam"]], on=["date", "homeTeam"], how="left", indicator=True)
+    added = added.loc[added["_merge"] == "left_only", ["date", "homeTeam", "homeScore", "awayScore", "awayTeam",
+                                                       "season"]]
+    if added.shape[0] > 0:
+        currentdata = settypes(pd.concat([currentdata, added], ignore_index=True))
+
+    # keep the games in the order they're played
+    currentdata = currentdata.iloc[np.argsort(datekeys(currentdata["date"]), kind="mergesort")]
+    currentdata.reset_index(inplace=True, drop=True)
+
+    # games that should have been played but still don't have a result
+    pending = currentdata.loc[(currentdata["homeScore"] < 0) & (datekeys(currentdata["date"]) <= today)]
+
+    report = {"updated": changed[["date", "homeTeam", "awayTeamLatest", "homeScore", "awayScore"]].rename(
+                  columns={"awayTeamLatest": "awayTeam"}),
+              "pending": pending[["date", "homeTeam", "awayTeam"]],
+              "rescheduled": moved[["date", "homeTeam", "awayTeam", "oldDate"]],
+              "added": added[["date", "homeTeam", "awayTeam"]]}
+    return currentdata, report
+
+
+def printupdates(country, comp, report):
+    print("{0} {1}: {2} updated, {3} still pending, {4} rescheduled, {5} added".format(
+        country, comp, report["updated"].shape[0], report["pending"].shape[0], report["rescheduled"].shape[0],
+        report["added"].shape[0]))
+    for kind in ["updated", "pending", "rescheduled"]:
+        for game in report[kind].itertuples():
+            print("  {0} {1:%Y-%m-%d} {2} v {3}".format(kind.capitalize(), pd.Timestamp(game.date), game.homeTeam,
+                                                         game.awayTeam))
+
+
+@timed("update", countrows=True)
+def updatecompetitionsdata(competitions, startseason, datapath, baseurl=BASEURL, connections=4, cache=None,
+                           storage="numpy", predictioncache=None):
+    currentseason = datetime.date.today().year
+
+    # load (or scrape) our current data
+    registry = openregistry(datapath)
+    datasets = getcompetitionsdata(competitions, startseason, datapath, baseurl, connections, cache, storage,
+                                   registry=registry)
+
+    # scrape the latest data for every competition at once, pages that haven't changed aren't parsed
+    from .scraping import scrapeseasons
+    latest = scrapeseasons([(country, comp, currentseason) for country, comp in competitions], baseurl, connections,
+                           cache=cache, skipunchanged=True)
+
+    updated = []
+    for (country, comp), currentdata, latestdata in zip(competitions, datasets, latest):
+        if latestdata is None:
+            print("No changes for", country, comp)
+            updated.append(currentdata)
+            continue
+
+        # the latest names go through the registry first, so a respelt team still matches the games we have
+        currentdata, report = updatescores(currentdata, addteamids(latestdata, registry))
+        currentdata = addteamids(currentdata, registry)
+        printupdates(country, comp, report)
+        for kind in ["updated", "rescheduled", "added"]:
+            count("update", kind, report[kind].shape[0])
+
+        # cached predictions made after the earliest changed game had it in their history, so drop them
+        if predictioncache is not None:
+            changed = [report[kind]["date"] for kind in ["updated", "rescheduled", "added"]]
+            changed.append(report["rescheduled"]["oldDate"])
+            changed = datekeys(pd.concat(changed))
+            if len(changed) > 0:
+                predictioncache.invalidate(competitionkey(country, comp), changed.min())
+
+        # save to file, only the current season can have changed
+        if storage == "sqlite":
+            savesqlitechanges(currentdata, report, datapath, competitionkey(country, comp))
+        else:
+            savecompetition(currentdata, country, comp, datapath, storage, [currentseason])
+        updated.append(currentdata)
+
+    # only now every competition is saved can the pages be marked as seen, so a failed run downloads them again
+    if cache is not None:
+        cache.save()
+    return updated
+
+
+def updatecompetitiondata(country, comp, startseason, datapath, baseurl=BASEURL, connections=4, cache=None,
+                          storage="numpy", predictioncache=None):
+    return updatecompetitionsdata([(country, comp)], startseason, datapath, baseurl, connections, cache, storage,
+                                  predictioncache)[0]
@@ -0,0 +1,45 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+BASEURL = "http://www.soccerpunter.com/soccer-statistics/"
+
+# each game parsed from a results page, a tuple keeps them small until the dataframe is built
+MatchRecord = namedtuple("MatchRecord", ["date", "homeTeam", "homeScore", "awayScore", "awayTeam"])
+
+
+def settypes(df):
+    # store dates as dates, team names as categories and scores as small integers
+    df["date"] = pd.to_datetime(df["date"])
+    df["homeTeam"] = df["homeTeam"].astype("category")
+    df["awayTeam"] = df["awayTeam"].astype("category")
+    df["homeScore"] = df["homeScore"].astype("int8")
+    df["awayScore"] = df["awayScore"].astype("int8")
+    if "season" in df:
+        df["season"] = df["season"].astype("int16")
+    return df
+
+
+def competitionfilename(country, comp, datapath, extension=".csv"):
+    return datapath + country + "-" + comp.replace(" ", "-").replace("/", "-") + extension
+
+
+def competitionkey(country, comp):
+    return country + ":" + comp
+
+
+def matchkeys(df):
+    # the columns we join games on, with dates as days and team names as plain strings
+    return pd.DataFrame({"date": datekeys(df["date"]),
+                         "homeTeam": df["homeTeam"].astype(str).values,
+                         "awayTeam": df["awayTeam"].astype(str).values}, index=df.index)
+
+
+def datekeys(dates):
+    # dates may be stored as strings or datetimes, turn them into numpy days so they sort and compare properly
+    return np.asarray(pd.to_datetime(dates), dtype="datetime64[ns]").astype("datetime64[D]")
+
+
+# the outcomes poissonpredict stores for each game
+PREDICTIONCOLUMNS = ["homeWin", "draw", "awayWin", "totalGoals", "threeOrMoreGoals", "bothTeamsToScore"]
@@ -0,0 +1,264 @@
+import numpy as np
+import pandas as pd
+
+from .data import PREDICTIONCOLUMNS, datekeys
+from .instrument import count, timed
+from .model import gameseeds, poissonprobabilities, printpredictions, rowhashes, storepredictions, uncachedgames
+from .teams import teamcodes
+
+# scipy's optimiser is used when it's installed, otherwise the bfgs below does the same job a little slower
+try:
+    from scipy.optimize import minimize
+except ImportError:
+    minimize = None
+
+# weight lost per day of age, at 0.0019 a game from a year ago counts half as much as today's (Dixon & Coles 1997)
+DECAY = 0.0019
+
+# games weighted below this are left out of the fit altogether
+MINWEIGHT = 0.001
+
+# the range rho is fitted in, fitted values are usually small and negative
+RHOBOUNDS = (-0.25, 0.25)
+
+
+def fitgames(df, gamedate, decay=DECAY):
+    # every played game before gamedate, as team codes and scores with a weight that falls away with age
+    played = df.loc[(df["date"] < gamedate) & (df["homeScore"] > -1)]
+    age = (datekeys([gamedate])[0] - datekeys(played["date"])).astype(float)
+    weights = np.exp(-decay * age)
+    keep = weights >= MINWEIGHT
+    played = played.loc[keep]
+
+    teams, home, away = teamcodes(played)
+    return {"teams": teams,
+            "home": home,
+            "away": away,
+            "homeScore": played["homeScore"].values.astype(float),
+            "awayScore": played["awayScore"].values.astype(float),
+            "weights": weights[keep],
+            "hash": np.sum(rowhashes(played), dtype=np.uint64)}
+
+
+def dixoncolesloss(params, games, penalty=1.0):
+    # negative time weighted log likelihood of the dixon-coles model and its gradient, for every game at once
+    # params are home advantage, rho, then an attack and a defence rating for every team, all on the log scale
+    teamcount = len(games["teams"])
+    homeadvantage, rho = params[0], params[1]
+    attack = params[2:2 + teamcount]
+    defence = params[2 + teamcount:]
+    home, away = games["home"], games["away"]
+    x, y, w = games["homeScore"], games["awayScore"], games["weights"]
+
+    homeexpected = np.exp(homeadvantage + attack[home] + defence[away])
+    awayexpected = np.exp(attack[away] + defence[home])
+
+    # the low score correction only touches 0-0, 0-1, 1-0 and 1-1
+    tau = np.ones_like(homeexpected)
+    dhome = np.zeros_like(homeexpected)
+    daway = np.zeros_like(homeexpected)
+    drho = np.zeros_like(homeexpected)
+
+    nilnil = (x == 0) & (y == 0)
+    tau[nilnil] = 1 - homeexpected[nilnil] * awayexpected[nilnil] * rho
+    dhome[nilnil] = -homeexpected[nilnil] * awayexpected[nilnil] * rho
+    daway[nilnil] = dhome[nilnil]
+    drho[nilnil] = -homeexpected[nilnil] * awayexpected[nilnil]
+
+    nilone = (x == 0) & (y == 1)
+    tau[nilone] = 1 + homeexpected[nilone] * rho
+    dhome[nilone] = homeexpected[nilone] * rho
+    drho[nilone] = homeexpected[nilone]
+
+    onenil = (x == 1) & (y == 0)
+    tau[onenil] = 1 + awayexpected[onenil] * rho
+    daway[onenil] = awayexpected[onenil] * rho
+    drho[onenil] = awayexpected[onenil]
+
+    oneone = (x == 1) & (y == 1)
+    tau[oneone] = 1 - rho
+    drho[oneone] = -1
+
+    # a correction that makes any result impossible is outside the model, the optimiser backs away from it
+    if np.any(tau <= 0):
+        return np.inf, np.zeros_like(params)
+
+    # poisson log likelihood without the factorials, which don't depend on the parameters
+    loglikelihood = np.sum(w * (x * np.log(homeexpected) - homeexpected + y * np.log(awayexpected) - awayexpected +
+                                np.log(tau)))
+
+    # derivatives against log expected goals, then gathered onto the teams involved
+    ghome = w * (x - homeexpected + dhome / tau)
+    gaway = w * (y - awayexpected + daway / tau)
+    gattack = np.bincount(home, ghome, teamcount) + np.bincount(away, gaway, teamcount)
+    gdefence = np.bincount(away, ghome, teamcount) + np.bincount(home, gaway, teamcount)
+
+    # a small ridge penalty pins down the ratings, which could otherwise all shift together, and steadies
+    # teams with only a few games
+    loss = -loglikelihood + penalty * 0.5 * (np.sum(attack ** 2) + np.sum(defence ** 2))
+    gradient = -np.concatenate(([np.sum(ghome)], [np.sum(w * drho / tau)], gattack, gdefence))
+    gradient[2:] += penalty * params[2:]
+    return loss, gradient
+
+
+def minimizebfgs(function, start, maxiter=500, tolerance=1e-9):
+    # plain bfgs with a backtracking line search, used when scipy isn't installed
+    # function returns the value and gradient together, the problem is small enough to keep a dense inverse hessian
+    x = np.asarray(start, dtype=float)
+    value, gradient = function(x)
+
+    # the first step is kept short, after it the curvature we've seen sets the scale
+    scale = 1 / max(1.0, np.max(np.abs(gradient)))
+    inverse = np.eye(len(x)) * scale
+    for iteration in range(maxiter):
+        # stop once the gradient is tiny next to the size of the loss
+        if np.max(np.abs(gradient)) < tolerance * max(1.0, abs(value)):
+            break
+
+        direction = -inverse.dot(gradient)
+        slope = gradient.dot(direction)
+        if slope >= 0:
+            # not a descent direction any more, start again from steepest descent
+            inverse = np.eye(len(x)) * scale
+            direction = -inverse.dot(gradient)
+            slope = gradient.dot(direction)
+
+        step = 1.0
+        while True:
+            newx = x + step * direction
+            newvalue, newgradient = function(newx)
+            if newvalue <= value + 1e-4 * step * slope or step < 1e-10:
+                break
+            step *= 0.5
+        if step < 1e-10:
+            break
+
+        # update the inverse hessian from the step we took
+        s = newx - x
+        y = newgradient - gradient
+        sy = s.dot(y)
+        if sy > 1e-12:
+            if iteration == 0:
+                scale = sy / y.dot(y)
+                inverse = np.eye(len(x)) * scale
+            inverse_y = inverse.dot(y)
+            inverse += ((sy + y.dot(inverse_y)) * np.outer(s, s) / sy ** 2 -
+                        (np.outer(inverse_y, s) + np.outer(s, inverse_y)) / sy)
+        x, value, gradient = newx, newvalue, newgradient
+    return x
+
+
+def startparams(teams, previous=None):
+    # warm start from an earlier fit, teams it didn't know start as average
+    params = np.zeros(2 + 2 * len(teams))
+    params[0] = 0.25
+    if previous is not None:
+        params[0] = previous["homeAdvantage"]
+        params[1] = previous["rho"]
+        known = previous["teams"].get_indexer(teams)
+        found = known >= 0
+        params[2:2 + len(teams)][found] = previous["attack"][known[found]]
+        params[2 + len(teams):][found] = previous["defence"][known[found]]
+    return params
+
+
+@timed("fit")
+def fitdixoncoles(df, gamedate, decay=DECAY, previous=None, penalty=1.0, lowscore=True, games=None):
+    # fit attack and defence ratings for every team from the games before gamedate
+    # previous is the fit from an earlier date, starting from it takes far fewer iterations
+    # games can be passed in when fitgames has already been run for this date
+    if games is None:
+        games = fitgames(df, gamedate, decay)
+    teams = games["teams"]
+    count("fit", "rows", len(games["weights"]))
+
+    start = startparams(teams, previous)
+    if not lowscore:
+        # fit without the correction by holding rho at zero
+        def function(params):
+            loss, gradient = dixoncolesloss(np.concatenate(([params[0], 0.0], params[1:])), games, penalty)
+            return loss, np.delete(gradient, 1)
+        start = np.delete(start, 1)
+    else:
+        def function(params):
+            return dixoncolesloss(params, games, penalty)
+
+    if len(teams) == 0:
+        params = start
+    elif minimize is not None:
+        # rho is kept where the correction stays valid for typical scores, scipy's line search can't back off from
+        # an impossible one by itself
+        # the loss runs to thousands, so the default tolerances can stop after a warm start has barely moved
+        bounds = [(None, None)] * len(start)
+        if lowscore:
+            bounds[1] = RHOBOUNDS
+        params = minimize(function, start, jac=True, method="L-BFGS-B", bounds=bounds,
+                          options={"ftol": 1e-12, "gtol": 1e-5}).x
+    else:
+        params = minimizebfgs(function, start)
+
+    if not lowscore:
+        params = np.concatenate(([params[0], 0.0], params[1:]))
+
+    return {"date": datekeys([gamedate])[0],
+            "decay": decay,
+            "teams": teams,
+            "homeAdvantage": params[0],
+            "rho": params[1],
+            "attack": params[2:2 + len(teams)],
+            "defence": params[2 + len(teams):],
+            "hash": games["hash"]}
+
+
+def fittedexpectedgoals(fit, hometeams, awayteams):
+    # expected goals for any pairing, teams the fit hasn't seen are treated as average
+    home = fit["teams"].get_indexer(pd.Index(hometeams).astype(str))
+    away = fit["teams"].get_indexer(pd.Index(awayteams).astype(str))
+    attack = np.append(fit["attack"], 0.0)
+    defence = np.append(fit["defence"], 0.0)
+    homeexpected = np.exp(fit["homeAdvantage"] + attack[home] + defence[away])
+    awayexpected = np.exp(attack[away] + defence[home])
+    return homeexpected, awayexpected
+
+
+@timed("batchPredict")
+def dixoncolespredict(df, gamedates, decay=DECAY, mode="analytic", seed=None, cache=None, competition="",
+                      previous=None):
+    # predict every game on the dates, refitting for each date from the fit before it
+    # returns the dataframe and the last fit, which can warm start the next call
+    found = {"index": [], "values": [], "keys": []}
+    gameindex = []
+    predictions = []
+    fit = previous
+
+    for gamedate in sorted(gamedates):
+        topredict = df.loc[df["date"] == gamedate]
+        if topredict.shape[0] == 0:
+            continue
+
+        # the cache key covers every game the fit would use, the decay stands in for the history length
+        games = fitgames(df, gamedate, decay)
+        model = "dixoncoles:{0}:{1}".format(decay, mode)
+        topredict = uncachedgames(cache, found, topredict, competition, gamedate, 0, model, seed, games["hash"])
+        if topredict.shape[0] == 0:
+            continue
+
+        fit = fitdixoncoles(df, gamedate, decay, previous=fit, games=games)
+        homexg, awayxg = fittedexpectedgoals(fit, topredict["homeTeam"].values, topredict["awayTeam"].values)
+        seeds = gameseeds(seed, topredict) if mode == "montecarlo" else seed
+        prediction = poissonprobabilities(homexg, awayxg, mode=mode, seed=seeds, rho=fit["rho"])
+        gameindex.append(topredict.index.values)
+        predictions.append(np.column_stack([prediction[column] for column in PREDICTIONCOLUMNS]))
+
+    return storepredictions(df, found, gameindex, predictions, cache), fit
+
+
+def dixoncolesgames(df, gamedate, decay=DECAY, cutoff=-1, mode="analytic", seed=None, cache=None, competition=""):
+    # the fitted model's version of poissonpredict, the decay takes the place of the history length
+    gamedates = gamedate if isinstance(gamedate, list) else [gamedate]
+    df, fit = dixoncolespredict(df, gamedates, decay, mode, seed, cache, competition)
+
+    if cutoff > 0:
+        printpredictions(df, gamedates, cutoff)
+
+    return df
@@ -0,0 +1,121 @@
+import functools
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# getrusage isn't available on windows, the memory peak is left out there
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# time taken and counts for each stage of a run, in the order the stages were first used
+STAGES = OrderedDict()
+LOCK = threading.Lock()
+STARTED = time.perf_counter()
+
+
+def stage(name):
+    if name not in STAGES:
+        STAGES[name] = OrderedDict([("calls", 0), ("seconds", 0.0)])
+    return STAGES[name]
+
+
+def count(name, counter, amount=1):
+    # add to one of a stage's counters, eg the rows it processed or the cache hits it had
+    with LOCK:
+        entry = stage(name)
+        entry[counter] = entry.get(counter, 0) + int(amount)
+
+
+def rowcount(result):
+    # the rows in a dataframe, or in a list of them, anything else counts as none
+    if isinstance(result, (list, tuple)):
+        return sum(rowcount(r) for r in result)
+    return result.shape[0] if hasattr(result, "shape") else 0
+
+
+def timed(name, countrows=False):
+    # time every call of the decorated function as the named stage, the cost is a clock read either side
+    # countrows adds up the rows of the dataframes it returns
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            result = None
+            try:
+                result = function(*args, **kwargs)
+                return result
+            finally:
+                taken = time.perf_counter() - started
+                with LOCK:
+                    entry = stage(name)
+                    entry["calls"] += 1
+                    entry["seconds"] += taken
+                    if countrows:
+                        entry["rows"] = entry.get("rows", 0) + rowcount(result)
+        return wrapper
+    return decorate
+
+
+def snapshot():
+    with LOCK:
+        return OrderedDict((name, OrderedDict(entry)) for name, entry in STAGES.items())
+
+
+def merge(stages):
+    # add in the stages recorded by another process, their seconds add up across processes
+    with LOCK:
+        for name, entry in stages.items():
+            target = stage(name)
+            for key, value in entry.items():
+                target[key] = target.get(key, 0) + value
+
+
+def poolworker(function, *args):
+    # runs function in a pool process, the stage timings recorded there are sent back with its result so the
+    # parent can merge them into its own
+    reset()
+    return function(*args), snapshot()
+
+
+def reset():
+    global STARTED
+    with LOCK:
+        STAGES.clear()
+        STARTED = time.perf_counter()
+
+
+def peakmemory(children=False):
+    # the most memory this process has held so far in MB, linux reports it in KB and macs in bytes
+    # children gives the largest of any finished process it started instead, such as the pool workers
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def report(**extra):
+    # everything recorded since the run started, including the stages pool processes sent back to be merged
+    with LOCK:
+        stages = OrderedDict((name, OrderedDict((key, round(value, 4) if isinstance(value, float) else value)
+                                                for key, value in entry.items()))
+                             for name, entry in STAGES.items())
+    result = OrderedDict([("wallTime", round(time.perf_counter() - STARTED, 4)),
+                          ("peakMemoryMB", peakmemory()),
+                          ("childPeakMemoryMB", peakmemory(children=True)),
+                          ("stages", stages)])
+    result.update(extra)
+    return result
+
+
+def savereport(filename, **extra):
+    # a filename of - prints the report instead
+    text = json.dumps(report(**extra), indent=2)
+    if filename == "-":
+        print(text)
+    else:
+        with open(filename, "w") as f:
+            f.write(text + "\n")
@@ -0,0 +1,430 @@
+import numpy as np
+import pandas as pd
+
+from .data import PREDICTIONCOLUMNS, datekeys, matchkeys
+from .instrument import count, timed
+from .teams import teamcodes
+
+
+def poissonpmf(expected, maxgoals):
+    # probability of scoring 0..maxgoals goals, k! built with a cumulative product so we don't need scipy
+    # expected can be a single value or an array of them, the goals axis is always added last
+    goals = np.arange(maxgoals + 1)
+    factorials = np.cumprod(np.concatenate(([1.0], goals[1:].astype(float))))
+    expected = np.asarray(expected, dtype=float)[..., np.newaxis]
+    return np.exp(-expected) * np.power(expected, goals) / factorials
+
+
+@timed("probabilities")
+def poissonprobabilities(homeexpected, awayexpected, mode="analytic", maxgoals=12, simulatedgames=100000,
+                         seed=None, rho=0.0):
+    # rho is the dixon-coles low score correction, it moves probability between 0-0, 1-0, 0-1 and 1-1
+    # seed can also be an array with a seed for each game, so a game's simulation doesn't depend on the others
+    count("probabilities", "rows", np.size(homeexpected))
+    if mode == "analytic":
+        # build the home x away score probability matrix, truncated at maxgoals for each team
+        # with arrays of expected goals we get one matrix per game and every reduction below works on all of them
+        homepmf = poissonpmf(homeexpected, maxgoals)
+        awaypmf = poissonpmf(awayexpected, maxgoals)
+        scores = homepmf[..., :, np.newaxis] * awaypmf[..., np.newaxis, :]
+        if np.any(rho != 0):
+            homeexpected = np.asarray(homeexpected, dtype=float)
+            awayexpected = np.asarray(awayexpected, dtype=float)
+            scores[..., 0, 0] *= 1 - homeexpected * awayexpected * rho
+            scores[..., 0, 1] *= 1 + homeexpected * rho
+            scores[..., 1, 0] *= 1 + awayexpected * rho
+            scores[..., 1, 1] *= 1 - rho
+        homegoals, awaygoals = np.indices(scores.shape[-2:])
+        totals = homegoals + awaygoals
+        matrix = (-2, -1)
+
+        # every outcome we need can be read straight off the matrix
+        homeTeamWins = np.sum(scores * (homegoals > awaygoals), axis=matrix) * 100
+        draws = np.sum(scores * (homegoals == awaygoals), axis=matrix) * 100
+        awayTeamWins = np.sum(scores * (homegoals < awaygoals), axis=matrix) * 100
+        totalGoals = np.sum(scores * totals, axis=matrix)
+        threeOrMoreGoals = (1 - np.sum(scores * (totals < 3), axis=matrix)) * 100
+        bothTeamsToScore = np.sum(scores[..., 1:, 1:], axis=matrix) * 100
+
+    elif mode == "montecarlo":
+        # a seeded generator means runs can be repeated and compared against the analytic mode
+        pergame = seed is not None and np.ndim(seed) > 0
+        rng = None if pergame else np.random.RandomState(seed)
+        homeexpected, awayexpected, rho = np.broadcast_arrays(np.asarray(homeexpected, dtype=float),
+                                                              np.asarray(awayexpected, dtype=float),
+                                                              np.asarray(rho, dtype=float))
+        results = np.empty(homeexpected.shape + (6,))
+
+        # simulate one game at a time so we never hold more than 2 x 100000 goals in memory
+        for i in np.ndindex(homeexpected.shape):
+            if pergame:
+                rng = np.random.RandomState(np.asarray(seed)[i])
+            # use numpy's poisson distribution to simulate 100000 games between the two teams
+            homeTeamPoisson = rng.poisson(homeexpected[i], simulatedgames)
+            awayTeamPoisson = rng.poisson(awayexpected[i], simulatedgames)
+
+            # the low score correction reweights the simulated games rather than simulating different ones
+            weights = None
+            if rho[i] != 0:
+                home, away = homeexpected[i], awayexpected[i]
+                weights = np.ones(simulatedgames)
+                weights[(homeTeamPoisson == 0) & (awayTeamPoisson == 0)] = 1 - home * away * rho[i]
+                weights[(homeTeamPoisson == 0) & (awayTeamPoisson == 1)] = 1 + home * rho[i]
+                weights[(homeTeamPoisson == 1) & (awayTeamPoisson == 0)] = 1 + away * rho[i]
+                weights[(homeTeamPoisson == 1) & (awayTeamPoisson == 1)] = 1 - rho[i]
+
+            # we can now infer some predictions from our simulated games
+            # using numpy to count the results and converting to percentage probability
+            results[i] = (np.average(homeTeamPoisson > awayTeamPoisson, weights=weights) * 100,
+                          np.average(homeTeamPoisson == awayTeamPoisson, weights=weights) * 100,
+                          np.average(homeTeamPoisson < awayTeamPoisson, weights=weights) * 100,
+                          np.average(homeTeamPoisson + awayTeamPoisson, weights=weights),
+                          np.average((homeTeamPoisson + awayTeamPoisson) > 2, weights=weights) * 100,
+                          np.average((homeTeamPoisson > 0) & (awayTeamPoisson > 0), weights=weights) * 100)
+
+        homeTeamWins, draws, awayTeamWins, totalGoals, threeOrMoreGoals, bothTeamsToScore = np.moveaxis(results, -1, 0)
+
+    else:
+        raise ValueError("Unknown prediction mode: " + str(mode))
+
+    return {"homeWin": homeTeamWins,
+            "draw": draws,
+            "awayWin": awayTeamWins,
+            "totalGoals": totalGoals,
+            "threeOrMoreGoals": threeOrMoreGoals,
+            "bothTeamsToScore": bothTeamsToScore}
+
+
+@timed("strengths")
+def teamstrengths(historical):
+    # get average home and away scores for entire competition
+    homeAvg = historical["homeScore"].mean()
+    awayAvg = historical["awayScore"].mean()
+
+    # a bincount for each venue adds up the goals scored and conceded by every team at once
+    teams, home, away = teamcodes(historical)
+    homescores = historical["homeScore"].values.astype(float)
+    awayscores = historical["awayScore"].values.astype(float)
+    homegames = np.bincount(home, minlength=len(teams))
+    awaygames = np.bincount(away, minlength=len(teams))
+
+    # divide averages for each team by averages for competition to get attack and defence strengths
+    # a team that only played at one venue gets NaN for the other, as the mean of no games
+    with np.errstate(divide="ignore", invalid="ignore"):
+        strengths = pd.DataFrame({"homeAttack": np.bincount(home, homescores, len(teams)) / homegames / homeAvg,
+                                  "homeDefence": np.bincount(home, awayscores, len(teams)) / homegames / awayAvg,
+                                  "awayAttack": np.bincount(away, awayscores, len(teams)) / awaygames / awayAvg,
+                                  "awayDefence": np.bincount(away, homescores, len(teams)) / awaygames / homeAvg},
+                                 index=teams)
+    return strengths, homeAvg, awayAvg
+
+
+def expectedgoals(strengths, homeAvg, awayAvg, hometeams, awayteams):
+    # gather the strengths for every game as arrays, teams without history come back as NaN
+    home = strengths.reindex(hometeams)
+    away = strengths.reindex(awayteams)
+
+    # calculated expected goals using attackstrength * defencestrength * average
+    homeTeamExpectedGoals = home["homeAttack"].values * away["awayDefence"].values * homeAvg
+    awayTeamExpectedGoals = away["awayAttack"].values * home["homeDefence"].values * awayAvg
+    return homeTeamExpectedGoals, awayTeamExpectedGoals
+
+
+def runseed(seed):
+    # the seed for a whole run, when none is given a fresh one is drawn so unseeded runs differ from each other
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % 2 ** 32)
+    return seed
+
+
+def offsetseed(seed, offset):
+    # a separate seed for each numbered piece of work (a history length, a chunk of seasons), so results don't
+    # depend on how the pieces are split between processes, no seed leaves every piece unseeded
+    if seed is None:
+        return None
+    return (seed * 1000003 + offset) % 2 ** 32
+
+
+def gameseeds(seed, games):
+    # a seed for each game made from the run's seed and the game itself, so a seeded simulation gives the same
+    # answer for a game whichever other games are predicted (or found in the cache) alongside it
+    if seed is None:
+        return None
+    hashes = pd.util.hash_pandas_object(matchkeys(games), index=False).values
+    return ((hashes ^ np.uint64(seed)) % np.uint64(2 ** 32)).astype(np.int64)
+
+
+def rowhashes(df):
+    # a hash of each game's date, teams and score, adding them up identifies a set of games whatever their order
+    keys = matchkeys(df)
+    keys["homeScore"] = df["homeScore"].values
+    keys["awayScore"] = df["awayScore"].values
+    return pd.util.hash_pandas_object(keys, index=False).values
+
+
+def prefixsums(codes, values, teamcount):
+    # row p holds each team's running total over the first p matches
+    sums = np.zeros((len(codes) + 1, teamcount))
+    sums[np.arange(1, len(codes) + 1), codes] = values
+    return np.cumsum(sums, axis=0)
+
+
+@timed("strengthIndex")
+def buildstrengthindex(df):
+    # only games with valid scores tell us anything, keep them in the order they were played
+    played = df.loc[df["homeScore"] > -1]
+    dates = datekeys(played["date"])
+    order = np.argsort(dates, kind="mergesort")
+    played = played.iloc[order]
+
+    teams, homecodes, awaycodes = teamcodes(played)
+    homescores = played["homeScore"].values.astype(float)
+    awayscores = played["awayScore"].values.astype(float)
+    ones = np.ones(len(played))
+
+    # cumulative sums over match order, the totals for any run of matches are then just a subtraction
+    # the hashes wrap around on overflow, which still leaves the difference between two rows correct
+    return {"teams": teams,
+            "dates": dates[order],
+            "hashes": np.concatenate((np.zeros(1, dtype=np.uint64), np.cumsum(rowhashes(played), dtype=np.uint64))),
+            "homeGoals": np.concatenate(([0.0], np.cumsum(homescores))),
+            "awayGoals": np.concatenate(([0.0], np.cumsum(awayscores))),
+            "homeGames": prefixsums(homecodes, ones, len(teams)),
+            "homeFor": prefixsums(homecodes, homescores, len(teams)),
+            "homeAgainst": prefixsums(homecodes, awayscores, len(teams)),
+            "awayGames": prefixsums(awaycodes, ones, len(teams)),
+            "awayFor": prefixsums(awaycodes, awayscores, len(teams)),
+            "awayAgainst": prefixsums(awaycodes, homescores, len(teams))}
+
+
+def indexwindow(index, gamedate, historylength):
+    # the last historylength matches before gamedate are the rows between start and end
+    end = np.searchsorted(index["dates"], datekeys([gamedate])[0], side="left")
+    return max(end - historylength, 0), end
+
+
+def indexwindowhash(index, gamedate, historylength):
+    start, end = indexwindow(index, gamedate, historylength)
+    return (index["hashes"][[end]] - index["hashes"][[start]])[0]
+
+
+@timed("strengths")
+def indexstrengths(index, gamedate, historylength):
+    start, end = indexwindow(index, gamedate, historylength)
+
+    def window(name):
+        return index[name][end] - index[name][start]
+
+    # get average home and away scores for entire competition
+    games = end - start
+    homeAvg = window("homeGoals") / games if games > 0 else np.nan
+    awayAvg = window("awayGoals") / games if games > 0 else np.nan
+
+    # teams with no games in the window get NaN, just like the mean of an empty selection
+    with np.errstate(divide="ignore", invalid="ignore"):
+        homegames = window("homeGames")
+        awaygames = window("awayGames")
+        strengths = pd.DataFrame({"homeAttack": window("homeFor") / homegames / homeAvg,
+                                  "homeDefence": window("homeAgainst") / homegames / awayAvg,
+                                  "awayAttack": window("awayFor") / awaygames / awayAvg,
+                                  "awayDefence": window("awayAgainst") / awaygames / homeAvg},
+                                 index=index["teams"])
+    return strengths, homeAvg, awayAvg
+
+
+def uncachedgames(cache, found, topredict, competition, gamedate, historylength, model, seed, windowhash):
+    # games we've already predicted from exactly the same history don't need predicting again
+    # the cached values and the keys of the rest are gathered in found, the games still to predict are returned
+    if cache is None:
+        return topredict
+    keys = [cache.key(competition, datekeys([gamedate])[0], ht, at, historylength, model, seed, windowhash)
+            for ht, at in zip(topredict["homeTeam"].values, topredict["awayTeam"].values)]
+    values = [cache.get(key) for key in keys]
+    cached = np.array([v is not None for v in values])
+    found["index"].append(topredict.index.values[cached])
+    found["values"] += [v for v in values if v is not None]
+    found["keys"] += [key for key, hit in zip(keys, cached) if not hit]
+    return topredict.loc[~cached]
+
+
+def storepredictions(df, found, gameindex, predictions, cache):
+    # fill in the games found in the cache and the ones just predicted, which are then cached too
+    count("batchPredict", "cacheHits", len(found["values"]))
+    count("batchPredict", "cacheMisses", len(found["keys"]))
+    count("batchPredict", "rows", len(found["values"]) + sum(len(games) for games in gameindex))
+    if len(found["values"]) > 0:
+        df.loc[np.concatenate(found["index"]), PREDICTIONCOLUMNS] = np.array(found["values"], dtype=float)
+
+    # with nothing left to predict the prediction columns are still added, so callers can always read them
+    if len(gameindex) == 0:
+        return df.reindex(columns=df.columns.union(PREDICTIONCOLUMNS, sort=False))
+
+    predictions = np.concatenate(predictions)
+    df.loc[np.concatenate(gameindex), PREDICTIONCOLUMNS] = predictions
+    if cache is not None:
+        cache.putmany(found["keys"], predictions.tolist())
+    return df
+
+
+@timed("batchPredict")
+def batchpredict(df, gamedates, historylength, mode="analytic", seed=None, index=None, cache=None, competition=""):
+    gameindex = []
+    homeexpected = []
+    awayexpected = []
+    found = {"index": [], "values": [], "keys": []}
+
+    for gamedate in gamedates:
+        # games to predict
+        topredict = df.loc[df["date"] == gamedate]
+        if topredict.shape[0] == 0:
+            continue
+
+        if index is None:
+            # only use games before the date we want to predict that have valid scores, limited to set length
+            historical = df.loc[(df["date"] < gamedate) & (df["homeScore"] > -1)].tail(historylength)
+
+        # games we've already predicted from exactly the same history don't need predicting again
+        if cache is not None:
+            if index is not None:
+                windowhash = indexwindowhash(index, gamedate, historylength)
+            else:
+                windowhash = np.sum(rowhashes(historical), dtype=np.uint64)
+            topredict = uncachedgames(cache, found, topredict, competition, gamedate, historylength, mode, seed,
+                                      windowhash)
+            if topredict.shape[0] == 0:
+                continue
+
+        # work out the strengths of every team once, then look up the teams playing on this date
+        if index is not None:
+            strengths, homeAvg, awayAvg = indexstrengths(index, gamedate, historylength)
+        else:
+            strengths, homeAvg, awayAvg = teamstrengths(historical)
+        homexg, awayxg = expectedgoals(strengths, homeAvg, awayAvg,
+                                       topredict["homeTeam"].values, topredict["awayTeam"].values)
+
+        gameindex.append(topredict.index.values)
+        homeexpected.append(homexg)
+        awayexpected.append(awayxg)
+
+    # work out the probability of each outcome for every game in a single call
+    predictions = []
+    if len(gameindex) > 0:
+        gameindex = [np.concatenate(gameindex)]
+        # simulated games each get their own seed, so a cache hit for one game doesn't change another's result
+        seeds = gameseeds(seed, df.loc[gameindex[0]]) if mode == "montecarlo" else seed
+        prediction = poissonprobabilities(np.concatenate(homeexpected), np.concatenate(awayexpected),
+                                          mode=mode, seed=seeds)
+        predictions.append(np.column_stack([prediction[column] for column in PREDICTIONCOLUMNS]))
+
+    # store our predictions into the dataframe
+    return storepredictions(df, found, gameindex, predictions, cache)
+
+
+def printpredictions(df, gamedates, cutoff):
+    # print out any game with a probability exceeding our cutoff, and the expected result
+    for i in df.index[np.isin(datekeys(df["date"]), datekeys(gamedates))]:
+        ht = df.loc[i, "homeTeam"]
+        at = df.loc[i, "awayTeam"]
+        homeTeamWins = df.loc[i, "homeWin"]
+        draws = df.loc[i, "draw"]
+        awayTeamWins = df.loc[i, "awayWin"]
+
+        if draws > cutoff or homeTeamWins > cutoff or awayTeamWins > cutoff:
+            if draws > cutoff:
+                result = "Draw"
+                probability = draws
+                odds = 100 / draws
+            elif homeTeamWins > cutoff:
+                result = ht + " Win"
+                probability = homeTeamWins
+                odds = 100 / homeTeamWins
+            elif awayTeamWins > cutoff:
+                result = at + " Win"
+                probability = awayTeamWins
+                odds = 100 / awayTeamWins
+            print("{0} v {1} : Prediction:{2}, Probability:{3:.2f}, Odds:{4:.2f}".format(ht, at, result, probability,
+                                                                                         odds))
+
+
+@timed("predict")
+def poissonpredict(df, gamedate, historylength, cutoff=-1, mode="analytic", seed=None, index=None, cache=None,
+                   competition=""):
+    # accept a single date or a list of dates, the whole list is predicted in one batch
+    gamedates = gamedate if isinstance(gamedate, list) else [gamedate]
+    df = batchpredict(df, gamedates, historylength, mode, seed, index, cache, competition)
+
+    # if probability exceeds our cutoff, print out the game and the expected result
+    if cutoff > 0:
+        printpredictions(df, gamedates, cutoff)
+
+    return df
+
+
+@timed("pairMatrix")
+def pairmatrix(tables, mode="analytic", seed=None):
+    # expected goals and probabilities for every home and away pairing of the teams in one or more strength tables
+    # tables is a list of (competition, strengths, homeAvg, awayAvg), as indexstrengths gives for each competition
+    competitions = np.concatenate([np.repeat(name, len(strengths)) for name, strengths, h, a in tables])
+    strengths = pd.concat([strengths for name, strengths, h, a in tables])
+    teams = pd.MultiIndex.from_arrays([competitions, strengths.index.astype(str)], names=["competition", "team"])
+    homeavg = np.concatenate([np.repeat(h, len(s)) for name, s, h, a in tables])
+    awayavg = np.concatenate([np.repeat(a, len(s)) for name, s, h, a in tables])
+
+    # within a competition this is expectedgoals for every pairing at once, across competitions the average goals
+    # of the two are combined as we know nothing of how the competitions compare
+    homeexpected = (strengths["homeAttack"].values[:, np.newaxis] * strengths["awayDefence"].values[np.newaxis, :] *
+                    np.sqrt(homeavg[:, np.newaxis] * homeavg[np.newaxis, :]))
+    awayexpected = (strengths["awayAttack"].values[np.newaxis, :] * strengths["homeDefence"].values[:, np.newaxis] *
+                    np.sqrt(awayavg[:, np.newaxis] * awayavg[np.newaxis, :]))
+    np.fill_diagonal(homeexpected, np.nan)
+    np.fill_diagonal(awayexpected, np.nan)
+
+    # teams without history (and a team against itself) are left as NaN, the rest are worked out in one call
+    valid = np.isfinite(homeexpected) & np.isfinite(awayexpected)
+    probabilities = np.full(homeexpected.shape + (len(PREDICTIONCOLUMNS),), np.nan, dtype=np.float32)
+    prediction = poissonprobabilities(homeexpected[valid], awayexpected[valid], mode=mode, seed=seed)
+    probabilities[valid] = np.column_stack([prediction[column] for column in PREDICTIONCOLUMNS])
+
+    return {"teams": teams,
+            "homeExpected": homeexpected.astype(np.float32),
+            "awayExpected": awayexpected.astype(np.float32),
+            "probabilities": probabilities}
+
+
+def pairposition(matrix, team):
+    # a team's row in the matrix, from its name or (competition, name) when the name is in more than one competition
+    teams = matrix["teams"]
+    if isinstance(team, tuple):
+        return teams.get_loc(team)
+    positions = np.flatnonzero(teams.get_level_values("team") == team)
+    if len(positions) != 1:
+        raise KeyError(team if len(positions) == 0 else "{0} is in more than one competition".format(team))
+    return positions[0]
+
+
+def pairprediction(matrix, hometeam, awayteam):
+    # look up one pairing in a matrix from pairmatrix
+    home = pairposition(matrix, hometeam)
+    away = pairposition(matrix, awayteam)
+    prediction = dict(zip(PREDICTIONCOLUMNS, matrix["probabilities"][home, away].tolist()))
+    prediction["homeExpectedGoals"] = float(matrix["homeExpected"][home, away])
+    prediction["awayExpectedGoals"] = float(matrix["awayExpected"][home, away])
+    return prediction
+
+
+def competitionpairs(indexes, names, gamedate, historylength, mode="analytic", seed=None, cache=None):
+    # the pair matrix for one or more competitions from their strength indexes, using the form up to gamedate
+    # the cache key holds the window hash of every competition, so a new or changed result makes a new matrix
+    windows = [(name, datekeys([gamedate])[0], historylength, indexwindowhash(index, gamedate, historylength))
+               for index, name in zip(indexes, names)]
+    if cache is not None:
+        key = cache.key(windows, mode, seed)
+        matrix = cache.get(key)
+        if matrix is not None:
+            return matrix
+
+    tables = [(name,) + indexstrengths(index, gamedate, historylength) for index, name in zip(indexes, names)]
+    matrix = pairmatrix(tables, mode, seed)
+    if cache is not None:
+        cache.put(key, matrix)
+    return matrix
@@ -0,0 +1,179 @@
+# downloading and parsing results pages, the only part of the package that needs requests and beautifulsoup
+import datetime
+import importlib.util
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+import requests
+from bs4 import BeautifulSoup as bs, SoupStrainer
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .data import BASEURL, MatchRecord, settypes
+from .instrument import count, timed
+from .teams import cleanname
+
+
+# lxml is optional, but much quicker at building the results table when it's available
+# only whether it's installed matters here, beautifulsoup imports it itself
+FASTPARSER = "lxml" if importlib.util.find_spec("lxml") is not None else "html.parser"
+
+
+def parsegames(games, today):
+    for game in games:
+
+        # these lines filter out any rows not containing game data, some competitions contain extra info.
+        try:
+            cls = game["class"]
+        except:
+            cls = "none"
+        if ("titleSpace" not in cls and "compHeading" not in cls and
+                    "matchEvents" not in cls and "compSubTitle" not in cls and cls != "none"):
+
+            datestr = game.find("a").text
+            gamedate = datetime.datetime.strptime(datestr, "%d/%m/%Y").date()
+
+            # filter out "extra time", "penalty shootout" and "neutral ground" markers
+            hometeam = cleanname(game.find("td", "teamHome").text)
+            awayteam = cleanname(game.find("td", "teamAway").text)
+
+            # if game was played before today, try and get the score
+            if gamedate < today:
+                scorestr = game.find("td", "score").text
+
+                # if the string holding the scores doesn't contain " - " then it hasn't yet been updated
+                if " - " in scorestr:
+                    homescore, awayscore = scorestr.split(" - ")
+
+                    # make sure the game wasn't cancelled postponed or suspended
+                    if homescore != "C" and homescore != "P" and homescore != "S":
+                        yield MatchRecord(gamedate, hometeam, int(homescore), int(awayscore), awayteam)
+            else:
+                # it's a future game, so store it with scores of -1
+                yield MatchRecord(gamedate, hometeam, -1, -1, awayteam)
+
+
+def findresultstable(content, fast=True):
+    if fast:
+        # only build the results table rather than the whole page, using lxml when it's installed
+        page = bs(content, FASTPARSER, parse_only=SoupStrainer("table", "competitionRanking"))
+        maintable = page.find("table", "competitionRanking")
+        if maintable is not None:
+            return maintable
+
+    # fall back to building the whole page, the way we always have
+    page = bs(content, "html.parser")
+    return page.find("table", "competitionRanking")
+
+
+@timed("parse", countrows=True)
+def parseseason(content, season, today=None, fast=True):
+    if today is None:
+        today = datetime.date.today()
+
+    # create beautifulsoup object and find the main data table within the page source
+    maintable = findresultstable(content, fast)
+
+    # seperate the data table into rows and build our dataframe in one go from the games they contain
+    games = maintable.find_all("tr")
+    df = settypes(pd.DataFrame.from_records(list(parsegames(games, today)), columns=MatchRecord._fields))
+
+    # sort our dataframe by date
+    df.sort_values(['date', 'homeTeam'], ascending=[True, True], inplace=True)
+    df.reset_index(inplace=True, drop=True)
+    # add a column containing the season, it'll come in handy later.
+    df["season"] = np.int16(season)
+    return df
+
+
+class HostRateLimiter:
+    # spaces out requests to each host so parallel downloads don't hammer a single site
+    def __init__(self, delay):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.nextrequest = {}
+
+    def wait(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            now = time.time()
+            start = max(now, self.nextrequest.get(host, now))
+            self.nextrequest[host] = start + self.delay
+        if start > now:
+            time.sleep(start - now)
+
+
+def makesession(connections=4, retries=3, backoff=0.5):
+    # one session shares its pooled connections between every download, retrying with backoff on errors
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=connections, pool_maxsize=connections, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def seasonurl(country, comp, season, baseurl=BASEURL):
+    return (baseurl + country + "/" + comp.replace(" ", "-").replace("/", "-") + "-"
+            + str(season) + "-" + str(season + 1) + "/results")
+
+
+def fetchpage(session, limiter, url, cache=None):
+    # returns the page and whether it has changed since we last downloaded it
+    limiter.wait(url)
+    response = session.get(url, headers=cache.headers(url) if cache is not None else None, timeout=30)
+
+    # the site says our copy is still current
+    if response.status_code == 304 and cache is not None:
+        count("fetch", "cacheHits")
+        return cache.get(url), False
+
+    response.raise_for_status()
+    count("fetch", "downloaded")
+    count("fetch", "bytes", len(response.content))
+    if cache is None:
+        return response.text, True
+    changed = cache.store(url, response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+    return response.text, changed
+
+
+@timed("fetch")
+def fetchpages(urls, connections=4, delay=0.5, session=None, cache=None):
+    if session is None:
+        session = makesession(connections)
+    limiter = HostRateLimiter(delay)
+
+    # download on a bounded pool of threads, the pages come back in the same order as the urls
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        pages = list(executor.map(lambda url: fetchpage(session, limiter, url, cache), urls))
+
+    # the cache index isn't saved here, the caller saves it once the games from the pages are stored, otherwise a run
+    # that fails in between would see the pages as unchanged next time and never store them
+    return pages
+
+
+@timed("scrape")
+def scrapeseasons(seasons, baseurl=BASEURL, connections=4, session=None, cache=None, skipunchanged=False):
+    # seasons is a list of (country, competition, season), which can cover several competitions
+    urls = []
+    for country, comp, season in seasons:
+        # output what the function is attempting to do.
+        print("Scraping:", country, comp, str(season) + "-" + str(season + 1))
+        urls.append(seasonurl(country, comp, season, baseurl))
+        print("URL:", urls[-1])
+        print("")
+
+    # download every page at once, then hand them to the parser
+    # pages that haven't changed since last time can be skipped, they come back as None
+    pages = fetchpages(urls, connections, session=session, cache=cache)
+    return [parseseason(content, season) if changed or not skipunchanged else None
+            for (country, comp, season), (content, changed) in zip(seasons, pages)]
+
+
+def scrapeseason(country, comp, season, baseurl=BASEURL, cache=None):
+    # scrape the page and turn it into a dataframe
+    return scrapeseasons([(country, comp, season)], baseurl, connections=1, cache=cache)[0]
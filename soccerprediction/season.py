@@ -0,0 +1,175 @@
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+from .data import datekeys
+from .instrument import count, merge, poolworker, timed
+from .model import buildstrengthindex, expectedgoals, indexstrengths, offsetseed, runseed
+from .teams import teamcodes
+
+# simulated seasons are worked through this many at a time, which caps the memory used whatever the total
+CHUNKSIZE = 5000
+
+
+def seasontable(df, season=None):
+    # the games of a season played so far and those still to play, the latest season unless another is given
+    if season is None:
+        season = df["season"].max()
+    games = df.loc[df["season"] == season]
+    isplayed = (games["homeScore"] > -1).values
+    played = games.loc[isplayed]
+    remaining = games.loc[games["homeScore"] == -1]
+
+    # every team in the season, including any that haven't played yet
+    teams, home, away = teamcodes(games)
+    home = home[isplayed]
+    away = away[isplayed]
+    homescores = played["homeScore"].values.astype(int)
+    awayscores = played["awayScore"].values.astype(int)
+
+    # points, goals and games so far for every team, gathered with bincount rather than a groupby per team
+    homepoints = np.where(homescores > awayscores, 3, np.where(homescores == awayscores, 1, 0))
+    awaypoints = np.where(awayscores > homescores, 3, np.where(homescores == awayscores, 1, 0))
+    table = {"teams": teams,
+             "season": season,
+             "played": np.bincount(home, minlength=len(teams)) + np.bincount(away, minlength=len(teams)),
+             "points": np.bincount(home, homepoints, len(teams)) + np.bincount(away, awaypoints, len(teams)),
+             "goalsFor": np.bincount(home, homescores, len(teams)) + np.bincount(away, awayscores, len(teams)),
+             "goalsAgainst": np.bincount(home, awayscores, len(teams)) + np.bincount(away, homescores, len(teams))}
+    for name in ["points", "goalsFor", "goalsAgainst"]:
+        table[name] = table[name].astype(int)
+    return table, remaining
+
+
+def remainingexpectedgoals(df, remaining, historylength, index=None):
+    # expected goals for every fixture left, from the last historylength games played, just as poissonpredict
+    # would predict them today
+    if index is None:
+        index = buildstrengthindex(df)
+    if len(index["dates"]) > 0:
+        latest = index["dates"][-1] + np.timedelta64(1, "D")
+    else:
+        latest = datekeys([datetime.date.today()])[0]
+    strengths, homeAvg, awayAvg = indexstrengths(index, latest, historylength)
+    homexg, awayxg = expectedgoals(strengths, homeAvg, awayAvg, remaining["homeTeam"].astype(str).values,
+                                   remaining["awayTeam"].astype(str).values)
+
+    # a team with no games in the window (just promoted, say) is treated as an average side rather than left
+    # as NaN, which can't be simulated
+    homexg = np.where(np.isnan(homexg), homeAvg, homexg)
+    awayxg = np.where(np.isnan(awayxg), awayAvg, awayxg)
+    return homexg, awayxg
+
+
+@timed("simulate")
+def simulatechunks(table, home, away, homexg, awayxg, chunks, chunksize, simulations, seed=None):
+    # simulate the chunks given, returning how often each team finished in each position and on each points total
+    teamcount = len(table["teams"])
+    maxpoints = int(table["points"].max()) + 3 * len(home) + 1
+    positions = np.zeros((teamcount, teamcount), dtype=np.int64)
+    points = np.zeros((teamcount, maxpoints), dtype=np.int64)
+    teamcodes = np.arange(teamcount)
+
+    # fixtures x teams tables that add each game's points and goals onto the teams that played it
+    hometeam = np.zeros((len(home), teamcount))
+    hometeam[np.arange(len(home)), home] = 1
+    awayteam = np.zeros((len(away), teamcount))
+    awayteam[np.arange(len(away)), away] = 1
+
+    for chunk in chunks:
+        size = min(chunksize, simulations - chunk * chunksize)
+        if size <= 0:
+            continue
+        count("simulate", "seasons", size)
+        rng = np.random.RandomState(offsetseed(seed, chunk))
+
+        # one row per simulated season, one column per remaining fixture
+        homegoals = rng.poisson(homexg, (size, len(home)))
+        awaygoals = rng.poisson(awayxg, (size, len(away)))
+        homepoints = np.where(homegoals > awaygoals, 3, np.where(homegoals == awaygoals, 1, 0))
+        awaypoints = np.where(awaygoals > homegoals, 3, np.where(homegoals == awaygoals, 1, 0))
+
+        # final points, goal difference and goals for every team in every simulated season
+        finalpoints = table["points"] + (homepoints.dot(hometeam) + awaypoints.dot(awayteam)).astype(int)
+        goalsfor = table["goalsFor"] + homegoals.dot(hometeam) + awaygoals.dot(awayteam)
+        goalsagainst = table["goalsAgainst"] + awaygoals.dot(hometeam) + homegoals.dot(awayteam)
+
+        # rank on points, then goal difference, then goals scored, anything still level is settled at random
+        # each tiebreak is scaled well below a single step of the one before it
+        order = (finalpoints + (goalsfor - goalsagainst) * 1e-3 + goalsfor * 1e-6 +
+                 rng.uniform(0, 1e-7, finalpoints.shape))
+        ranks = np.argsort(np.argsort(-order, axis=1), axis=1)
+
+        # add this chunk to the running histograms, the chunk itself can then be dropped
+        positions += np.bincount((teamcodes * teamcount + ranks).ravel(),
+                                 minlength=teamcount * teamcount).reshape(teamcount, teamcount)
+        points += np.bincount((teamcodes * maxpoints + finalpoints).ravel(),
+                              minlength=teamcount * maxpoints).reshape(teamcount, maxpoints)
+
+    return positions, points
+
+
+@timed("season")
+def simulateseason(df, historylength=100, simulations=100000, chunksize=CHUNKSIZE, seed=None, jobs=1, season=None,
+                   index=None):
+    # simulate the rest of the season many times over, keeping only the position and points histograms
+    table, remaining = seasontable(df, season)
+    home = table["teams"].get_indexer(remaining["homeTeam"].astype(str))
+    away = table["teams"].get_indexer(remaining["awayTeam"].astype(str))
+    homexg, awayxg = remainingexpectedgoals(df, remaining, historylength, index)
+
+    # the chunks are numbered so the seeds, and so the results, are the same however many processes there are
+    # without a seed one is drawn for this run, so repeated runs differ but still don't depend on the processes
+    seed = runseed(seed)
+    chunkcount = -(-simulations // chunksize)
+    chunks = [list(c) for c in np.array_split(np.arange(chunkcount), max(min(jobs, chunkcount), 1)) if len(c) > 0]
+    tasks = [(table, home, away, homexg, awayxg, c, chunksize, simulations, seed) for c in chunks]
+    if jobs > 1 and len(tasks) > 1:
+        completed = []
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for result, stages in executor.map(poolworker, repeat(simulatechunks), *zip(*tasks)):
+                merge(stages)
+                completed.append(result)
+    else:
+        completed = [simulatechunks(*task) for task in tasks]
+
+    return {"teams": table["teams"],
+            "season": table["season"],
+            "simulations": simulations,
+            "table": table,
+            "fixtures": len(remaining),
+            "positions": sum(positions for positions, points in completed),
+            "points": sum(points for positions, points in completed)}
+
+
+def seasonsummary(result, relegation=3):
+    # the current table alongside each team's chance of every finishing position, best projected team first
+    table = result["table"]
+    simulations = result["simulations"]
+    teamcount = len(result["teams"])
+    positions = result["positions"] / simulations * 100
+    points = result["points"] / simulations
+    relegated = positions[:, teamcount - relegation:].sum(axis=1) if relegation > 0 else np.zeros(teamcount)
+
+    summary = pd.DataFrame({"team": result["teams"],
+                            "played": table["played"],
+                            "points": table["points"],
+                            "goalDifference": table["goalsFor"] - table["goalsAgainst"],
+                            "expectedPoints": points.dot(np.arange(points.shape[1])),
+                            "expectedPosition": positions.dot(np.arange(1, teamcount + 1)) / 100,
+                            "title": positions[:, 0],
+                            "relegation": relegated})
+    for p in range(teamcount):
+        summary[str(p + 1)] = positions[:, p]
+    return summary.sort_values(["expectedPosition", "team"]).reset_index(drop=True)
+
+
+def printseason(summary):
+    # the projected table, with the chance of every position after it
+    print("{0:<24}{1:>4}{2:>5}{3:>5}{4:>8}{5:>8}{6:>8}".format("Team", "P", "Pts", "GD", "xPts", "Title", "Down"))
+    for row in summary.itertuples():
+        print("{0:<24}{1:>4}{2:>5}{3:>5}{4:>8.1f}{5:>7.1f}%{6:>7.1f}%".format(
+            row.team[:23], row.played, row.points, row.goalDifference, row.expectedPoints, row.title, row.relegation))
@@ -0,0 +1,289 @@
+import asyncio
+import datetime
+import json
+import math
+import time
+from collections import OrderedDict
+from os import path, walk
+from urllib.parse import urlsplit, parse_qs
+
+import pandas as pd
+
+from .caches import MatrixCache, PageCache, PredictionCache
+from .competitions import getcompetitionsdata, updatescores
+from .data import BASEURL, PREDICTIONCOLUMNS, competitionkey, datekeys
+from .model import batchpredict, buildstrengthindex, competitionpairs, expectedgoals, indexstrengths
+from .model import poissonprobabilities
+from .storage import loadcompetition, storedcompetition
+from .teams import addteamids, openregistry
+
+
+def storagesignature(country, comp, datapath, storage):
+    # the latest modification time of everything the competition is stored in, so we can tell when it's rewritten
+    if storage == "sqlite":
+        location = path.join(datapath, "soccer.sqlite")
+        files = [location, location + "-wal"]
+    else:
+        location = storedcompetition(country, comp, datapath, storage)
+        files = [location] + [path.join(folder, name) for folder, folders, names in walk(location)
+                              for name in folders + names]
+    return max([0] + [int(path.getmtime(f) * 1e9) for f in files if path.exists(f)])
+
+
+def jsonvalue(value):
+    # teams without any history give NaN, which json can't carry
+    value = float(value)
+    return None if math.isnan(value) else round(value, 4)
+
+
+class RequestError(Exception):
+    # a request we can't answer, carrying the http status to reply with
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+        self.message = message
+
+
+class CompetitionState:
+    # everything we keep loaded for one competition, swapped out as a whole when the stored data changes
+    def __init__(self, country, comp, data, signature):
+        self.country = country
+        self.comp = comp
+        self.name = competitionkey(country, comp)
+        self.data = data
+        self.signature = signature
+        self.dates = datekeys(data["date"])
+        self.index = buildstrengthindex(data)
+        self.strengths = OrderedDict()
+
+    def teamstrengths(self, gamedate, historylength):
+        # the strength table for a date and history length, kept for the ad-hoc pairings that follow
+        key = (datekeys([gamedate])[0], historylength)
+        if key not in self.strengths:
+            self.strengths[key] = indexstrengths(self.index, gamedate, historylength)
+            while len(self.strengths) > 1000:
+                self.strengths.popitem(last=False)
+        self.strengths.move_to_end(key)
+        return self.strengths[key]
+
+
+class PredictionServer:
+    def __init__(self, competitions, datapath, storage="numpy", history=100, mode="analytic", seed=None,
+                 baseurl=BASEURL, connections=4):
+        self.competitions = competitions
+        self.datapath = datapath
+        self.storage = storage
+        self.history = history
+        self.mode = mode
+        self.seed = seed
+        self.predictioncache = PredictionCache()
+        self.matrixcache = MatrixCache()
+        self.states = OrderedDict()
+
+        # load (or scrape) every competition once up front, from then on everything is answered from memory
+        cache = PageCache(path.join(datapath, "cache"), 100 * 1024 * 1024, False)
+        datasets = getcompetitionsdata(competitions, 2014, datapath, baseurl, connections, cache, storage)
+        for (country, comp), data in zip(competitions, datasets):
+            state = CompetitionState(country, comp, data, storagesignature(country, comp, datapath, storage))
+            self.states[state.name] = state
+
+    def reload(self):
+        # reload only the competitions that have been saved since we loaded them
+        reloaded = []
+        registry = None
+        for name, state in list(self.states.items()):
+            signature = storagesignature(state.country, state.comp, self.datapath, self.storage)
+            if signature == state.signature:
+                continue
+
+            latest = loadcompetition(state.country, state.comp, self.datapath, self.storage)
+            if latest is None:
+                continue
+
+            # the registry is read again each time, an update may have given out new ids since we last looked
+            # games from seasons saved before teams had ids get them here, as they do when first loaded
+            if registry is None:
+                registry = openregistry(self.datapath)
+            latest = addteamids(latest, registry)
+
+            # cached predictions from before the earliest changed game are still good, the rest are dropped
+            report = updatescores(state.data, latest)[1]
+            changed = [report[kind]["date"] for kind in ["updated", "rescheduled", "added"]]
+            changed.append(report["rescheduled"]["oldDate"])
+            changed = datekeys(pd.concat(changed))
+            if len(changed) > 0:
+                self.predictioncache.invalidate(name, changed.min())
+
+            self.states[name] = CompetitionState(state.country, state.comp, latest, signature)
+            reloaded.append({"competition": name, "updated": int(report["updated"].shape[0]),
+                             "rescheduled": int(report["rescheduled"].shape[0]),
+                             "added": int(report["added"].shape[0])})
+        return reloaded
+
+    def competition(self, query):
+        name = query.get("competition", [None])[0]
+        if name is None:
+            raise RequestError(400, "competition is required, eg competition=England:Premier League")
+        if name not in self.states:
+            raise RequestError(404, "unknown competition " + name)
+        return self.states[name]
+
+    def querydate(self, query):
+        try:
+            return pd.Timestamp(query.get("date", [datetime.date.today().strftime("%Y-%m-%d")])[0])
+        except ValueError:
+            raise RequestError(400, "date should be YYYY-MM-DD")
+
+    def queryhistory(self, query):
+        try:
+            history = int(query.get("history", [self.history])[0])
+        except ValueError:
+            raise RequestError(400, "history should be a number of games")
+        # with no games to work from every prediction would be empty
+        if history <= 0:
+            raise RequestError(400, "history should be at least 1 game")
+        return history
+
+    def listcompetitions(self, query):
+        return {"competitions": [{"competition": name,
+                                  "teams": len(state.index["teams"]),
+                                  "games": int(state.data.shape[0]),
+                                  "lastResult": str(state.index["dates"][-1]) if len(state.index["dates"]) else None}
+                                 for name, state in self.states.items()]}
+
+    def predict(self, query):
+        # every fixture on the date, predicted together from the loaded strength index
+        state = self.competition(query)
+        gamedate = self.querydate(query)
+        history = self.queryhistory(query)
+
+        games = state.data.loc[state.dates == datekeys([gamedate])[0],
+                               ["date", "homeTeam", "awayTeam", "homeScore", "awayScore"]].copy()
+        if games.shape[0] > 0:
+            games = batchpredict(games, [gamedate], history, self.mode, self.seed, state.index,
+                                 self.predictioncache, state.name)
+
+        return {"competition": state.name, "date": gamedate.strftime("%Y-%m-%d"), "history": history,
+                "games": [dict([("homeTeam", str(game.homeTeam)), ("awayTeam", str(game.awayTeam))] +
+                               [(column, jsonvalue(getattr(game, column))) for column in PREDICTIONCOLUMNS])
+                          for game in games.itertuples()]}
+
+    def probability(self, query):
+        # any home and away pairing, whether or not they have a fixture
+        state = self.competition(query)
+        gamedate = self.querydate(query)
+        history = self.queryhistory(query)
+        hometeam = query.get("home", [None])[0]
+        awayteam = query.get("away", [None])[0]
+        if hometeam is None or awayteam is None:
+            raise RequestError(400, "home and away teams are required")
+        if hometeam == awayteam:
+            raise RequestError(400, "home and away teams should be different")
+        for team in [hometeam, awayteam]:
+            if team not in state.index["teams"]:
+                raise RequestError(404, "unknown team " + team)
+
+        strengths, homeAvg, awayAvg = state.teamstrengths(gamedate, history)
+        homexg, awayxg = expectedgoals(strengths, homeAvg, awayAvg, [hometeam], [awayteam])
+        prediction = poissonprobabilities(homexg, awayxg, mode=self.mode, seed=self.seed)
+
+        return dict([("competition", state.name), ("date", gamedate.strftime("%Y-%m-%d")), ("history", history),
+                     ("homeTeam", hometeam), ("awayTeam", awayteam),
+                     ("homeExpectedGoals", jsonvalue(homexg[0])), ("awayExpectedGoals", jsonvalue(awayxg[0]))] +
+                    [(column, jsonvalue(prediction[column][0])) for column in PREDICTIONCOLUMNS])
+
+    def matrix(self, query):
+        # every home and away pairing of one or more competitions, several competition= give the cross-league pairs
+        states = [self.competition({"competition": [name]}) for name in query.get("competition", [None])]
+        gamedate = self.querydate(query)
+        history = self.queryhistory(query)
+        matrix = competitionpairs([state.index for state in states], [state.name for state in states], gamedate,
+                                  history, self.mode, self.seed, self.matrixcache)
+
+        def table(values):
+            return [[jsonvalue(value) for value in row] for row in values]
+
+        return {"competitions": [state.name for state in states], "date": gamedate.strftime("%Y-%m-%d"),
+                "history": history,
+                "teams": [{"competition": competition, "team": team} for competition, team in matrix["teams"]],
+                "homeExpectedGoals": table(matrix["homeExpected"]),
+                "awayExpectedGoals": table(matrix["awayExpected"]),
+                "columns": PREDICTIONCOLUMNS,
+                "probabilities": [table(row) for row in matrix["probabilities"]]}
+
+    def respond(self, target):
+        # work out the reply to one request, as a status code and something json can encode
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        routes = {"/competitions": self.listcompetitions,
+                  "/predict": self.predict,
+                  "/probability": self.probability,
+                  "/matrix": self.matrix,
+                  "/reload": lambda query: {"reloaded": self.reload()},
+                  "/stats": lambda query: dict(self.predictioncache.stats(),
+                                               matrixCache=self.matrixcache.stats())}
+        if url.path not in routes:
+            return 404, {"error": "unknown path " + url.path}
+        try:
+            return 200, routes[url.path](query)
+        except RequestError as e:
+            return e.status, {"error": e.message}
+
+    async def handle(self, reader, writer):
+        # one connection can carry several requests, we answer them in turn until the client is done
+        try:
+            while True:
+                requestline = await reader.readline()
+                if not requestline:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                parts = requestline.decode("latin-1").split()
+                started = time.perf_counter()
+                if len(parts) != 3:
+                    status, reply = 400, {"error": "bad request"}
+                elif parts[0] != "GET":
+                    status, reply = 405, {"error": "only GET is supported"}
+                else:
+                    status, reply = self.respond(parts[1])
+                taken = time.perf_counter() - started
+
+                body = json.dumps(reply).encode("utf-8")
+                keepalive = headers.get("connection", "").lower() != "close" and parts[-1:] == ["HTTP/1.1"]
+                writer.write("HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\n"
+                             "Server-Timing: predict;dur={3:.3f}\r\nConnection: {4}\r\n\r\n".format(
+                              status, "OK" if status == 200 else "Error", len(body), taken * 1000,
+                              "keep-alive" if keepalive else "close").encode("latin-1") + body)
+                await writer.drain()
+                if not keepalive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def watch(self, interval):
+        # look for newly saved results every so often, loading them doesn't hold up requests for long
+        while True:
+            await asyncio.sleep(interval)
+            for reloaded in self.reload():
+                print("Reloaded {competition}: {updated} updated, {rescheduled} rescheduled, {added} added".format(
+                    **reloaded))
+
+    async def serve(self, host, port, interval):
+        server = await asyncio.start_server(self.handle, host, port)
+        print("Serving predictions for", ", ".join(self.states), "on http://{0}:{1}/".format(host, port))
+        watcher = asyncio.ensure_future(self.watch(interval)) if interval > 0 else None
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
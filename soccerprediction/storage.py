@@ -0,0 +1,253 @@
+import sqlite3
+from os import path, listdir, makedirs, replace
+
+import numpy as np
+import pandas as pd
+
+from .data import PREDICTIONCOLUMNS, competitionfilename, competitionkey, matchkeys, settypes
+from .instrument import timed
+
+
+def loadcsv(filename):
+    return settypes(pd.read_csv(filename, index_col=0))
+
+
+def savecsv(data, filename, seasons=None):
+    # a csv can't be partly rewritten, so every season is saved each time
+    data.to_csv(filename)
+
+
+def seasonpartitions(data, seasons):
+    # the part of the data belonging to each season we want to save
+    if seasons is None:
+        seasons = data["season"].unique()
+    for season in seasons:
+        yield season, data.loc[data["season"] == season]
+
+
+def savearray(filename, values):
+    # write to a temporary file first so a crash never leaves a half written partition behind
+    with open(filename + ".tmp", "wb") as f:
+        np.save(f, values)
+    replace(filename + ".tmp", filename)
+
+
+def loadparquet(folder):
+    # seasons are read separately, as only some of them may have prediction columns
+    partitions = [pd.read_parquet(path.join(folder, f)) for f in sorted(listdir(folder)) if f.endswith(".parquet")]
+    return settypes(pd.concat(partitions, ignore_index=True))
+
+
+def saveparquet(data, folder, seasons=None):
+    if not path.exists(folder):
+        makedirs(folder)
+    for season, partition in seasonpartitions(data, seasons):
+        filename = path.join(folder, str(season) + ".parquet")
+        partition.reset_index(drop=True).to_parquet(filename + ".tmp")
+        replace(filename + ".tmp", filename)
+
+
+def loadnumpy(folder):
+    seasons = sorted(listdir(folder))
+    arrays = {}
+    categories = {}
+    rows = []
+
+    # gather each column from every season first, so the frame only has to be built once
+    for s, season in enumerate(seasons):
+        seasonfolder = path.join(folder, season)
+        for column in np.load(path.join(seasonfolder, "_columns.npy")):
+            arrays.setdefault(column, {})[s] = np.load(path.join(seasonfolder, column + ".npy"))
+            categoryfile = path.join(seasonfolder, column + ".categories.npy")
+            if path.isfile(categoryfile):
+                categories.setdefault(column, {})[s] = np.load(categoryfile)
+        rows.append(len(arrays["date"][s]))
+
+    columns = {}
+    for column, parts in arrays.items():
+        if column in categories:
+            # team names are stored as codes into each season's list of names, move them onto one combined list
+            names = np.unique(np.concatenate(list(categories[column].values())))
+            codes = np.concatenate([np.searchsorted(names, categories[column][s])[parts[s]] for s in sorted(parts)])
+            columns[column] = pd.Categorical.from_codes(codes, names)
+        elif len(parts) == len(seasons):
+            columns[column] = np.concatenate([parts[s] for s in sorted(parts)])
+        elif column in ["homeTeamId", "awayTeamId"]:
+            # seasons saved before teams had ids don't have them, addteamids gives every game one again
+            continue
+        else:
+            # a column only some seasons have, like predictions, is empty for the others
+            columns[column] = np.concatenate([parts[s] if s in parts else np.full(rows[s], np.nan)
+                                              for s in range(len(seasons))])
+
+    return pd.DataFrame(columns)
+
+
+def savenumpy(data, folder, seasons=None):
+    for season, partition in seasonpartitions(data, seasons):
+        seasonfolder = path.join(folder, str(season))
+        if not path.exists(seasonfolder):
+            makedirs(seasonfolder)
+
+        # one typed array per column, team names are stored as category codes plus the list of names
+        for column in partition.columns:
+            values = partition[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                savearray(path.join(seasonfolder, column + ".categories.npy"),
+                          np.asarray(values.cat.categories, dtype=str))
+                values = values.cat.codes
+            savearray(path.join(seasonfolder, column + ".npy"), values.values)
+        savearray(path.join(seasonfolder, "_columns.npy"), np.array(partition.columns, dtype=str))
+
+
+# each storage format has a loader, a saver and the extension of the file or folder it lives in
+STORAGE = {"csv": (loadcsv, savecsv, ".csv"),
+           "parquet": (loadparquet, saveparquet, ".parquet"),
+           "numpy": (loadnumpy, savenumpy, ".npy")}
+
+
+# every competition shares one database, the primary keys also index (competition, date)
+SQLITESCHEMA = """
+CREATE TABLE IF NOT EXISTS matches (competition TEXT NOT NULL, season INTEGER NOT NULL, date TEXT NOT NULL,
+                                    homeTeam TEXT NOT NULL, homeScore INTEGER NOT NULL, awayScore INTEGER NOT NULL,
+                                    awayTeam TEXT NOT NULL, PRIMARY KEY (competition, date, homeTeam));
+CREATE INDEX IF NOT EXISTS matchesHomeTeam ON matches (competition, homeTeam);
+CREATE INDEX IF NOT EXISTS matchesAwayTeam ON matches (competition, awayTeam);
+CREATE TABLE IF NOT EXISTS predictions (competition TEXT NOT NULL, date TEXT NOT NULL, homeTeam TEXT NOT NULL,
+                                        homeWin REAL, draw REAL, awayWin REAL, totalGoals REAL,
+                                        threeOrMoreGoals REAL, bothTeamsToScore REAL,
+                                        PRIMARY KEY (competition, date, homeTeam));
+"""
+
+
+def opendatabase(datapath):
+    connection = sqlite3.connect(path.join(datapath, "soccer.sqlite"), timeout=60, isolation_level=None)
+    # write ahead logging lets predictions keep reading while another process updates scores
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(SQLITESCHEMA)
+    return connection
+
+
+def writesqlite(connection, deletes, matches, predictions):
+    # take the write lock up front so concurrent updates queue up rather than fail half way through
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.executemany("DELETE FROM matches WHERE competition = ? AND date = ? AND homeTeam = ?", deletes)
+        connection.executemany("DELETE FROM predictions WHERE competition = ? AND date = ? AND homeTeam = ?", deletes)
+        connection.executemany("INSERT OR REPLACE INTO matches (competition, season, date, homeTeam, homeScore, "
+                               "awayScore, awayTeam) VALUES (?, ?, ?, ?, ?, ?, ?)", matches)
+        connection.executemany("INSERT OR REPLACE INTO predictions (competition, date, homeTeam, " +
+                               ", ".join(PREDICTIONCOLUMNS) + ") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", predictions)
+        connection.execute("COMMIT")
+    except:
+        connection.execute("ROLLBACK")
+        raise
+
+
+def sqliterows(competition, data):
+    # turn games into rows for the matches table and, where they've been predicted, the predictions table
+    dates = pd.to_datetime(data["date"]).dt.strftime("%Y-%m-%d").values
+    hometeams = data["homeTeam"].astype(str).values
+    matches = list(zip([competition] * data.shape[0], data["season"].astype(int), dates, hometeams,
+                       data["homeScore"].astype(int), data["awayScore"].astype(int),
+                       data["awayTeam"].astype(str).values))
+    predictions = []
+    if "homeWin" in data:
+        predicted = data["homeWin"].notna().values
+        predictions = list(zip([competition] * int(predicted.sum()), dates[predicted], hometeams[predicted],
+                               *[data.loc[predicted, column].astype(float) for column in PREDICTIONCOLUMNS]))
+    return matches, predictions
+
+
+def readsqlite(connection, query, parameters):
+    data = pd.read_sql_query("SELECT m.season, m.date, m.homeTeam, m.homeScore, m.awayScore, m.awayTeam, " +
+                             ", ".join("p." + column for column in PREDICTIONCOLUMNS) + " FROM (" + query + ") m "
+                             "LEFT JOIN predictions p USING (competition, date, homeTeam) "
+                             "ORDER BY m.date, m.homeTeam", connection, params=parameters)
+    if data.shape[0] == 0:
+        return None
+
+    # only keep prediction columns that have something in them, like the other storage formats
+    data = data.drop(columns=[column for column in PREDICTIONCOLUMNS if data[column].isna().all()])
+    return settypes(data[["date", "homeTeam", "homeScore", "awayScore", "awayTeam", "season"] +
+                         [column for column in PREDICTIONCOLUMNS if column in data]])
+
+
+def loadsqlite(datapath, competition, window=None):
+    connection = opendatabase(datapath)
+    try:
+        if window is None:
+            return readsqlite(connection, "SELECT * FROM matches WHERE competition = ?", [competition])
+
+        # only fetch the games the prediction needs, the history before the first date and everything from there on
+        gamedates, historylength = window
+        dates = pd.to_datetime(pd.Series(gamedates)).dt.strftime("%Y-%m-%d")
+        return readsqlite(connection,
+                          "SELECT * FROM (SELECT * FROM matches WHERE competition = ? AND date < ? AND homeScore > -1 "
+                          "ORDER BY date DESC, homeTeam DESC LIMIT ?) UNION ALL "
+                          "SELECT * FROM matches WHERE competition = ? AND date >= ? AND date <= ?",
+                          [competition, dates.min(), int(historylength), competition, dates.min(), dates.max()])
+    finally:
+        connection.close()
+
+
+def savesqlite(data, datapath, competition, seasons=None):
+    if seasons is not None:
+        data = data.loc[data["season"].isin(seasons)]
+    matches, predictions = sqliterows(competition, data)
+    connection = opendatabase(datapath)
+    try:
+        writesqlite(connection, [], matches, predictions)
+    finally:
+        connection.close()
+
+
+def savesqlitechanges(data, report, datapath, competition):
+    # only write the games an update changed, moving rescheduled games off their old date
+    changed = pd.concat([report[kind][["date", "homeTeam"]] for kind in ["updated", "rescheduled", "added"]])
+    rows = matchkeys(data).reset_index().merge(changed.astype({"homeTeam": str}), on=["date", "homeTeam"])["index"]
+    matches, predictions = sqliterows(competition, data.loc[rows.values])
+    olddates = pd.to_datetime(pd.Series(report["rescheduled"]["oldDate"].values)).dt.strftime("%Y-%m-%d")
+    deletes = list(zip([competition] * len(olddates), olddates, report["rescheduled"]["homeTeam"].astype(str)))
+
+    connection = opendatabase(datapath)
+    try:
+        writesqlite(connection, deletes, matches, predictions)
+    finally:
+        connection.close()
+
+
+def storedcompetition(country, comp, datapath, storage):
+    return competitionfilename(country, comp, datapath, STORAGE[storage][2])
+
+
+@timed("storageLoad", countrows=True)
+def loadcompetition(country, comp, datapath, storage="numpy", window=None):
+    # returns None if we don't have this competition yet
+    # window is the (dates, history length) we want to predict, when the storage can fetch just those games
+    if storage == "sqlite":
+        data = loadsqlite(datapath, competitionkey(country, comp), window)
+        if data is not None:
+            return data
+    else:
+        location = storedcompetition(country, comp, datapath, storage)
+        if path.exists(location):
+            return STORAGE[storage][0](location)
+
+    # we may have it saved as a csv from before, if so move it to the storage we want to use
+    csvfile = competitionfilename(country, comp, datapath)
+    if storage != "csv" and path.isfile(csvfile):
+        data = loadcsv(csvfile)
+        savecompetition(data, country, comp, datapath, storage)
+        return data
+
+    return None
+
+
+@timed("storageSave")
+def savecompetition(data, country, comp, datapath, storage="numpy", seasons=None):
+    # seasons limits the save to the seasons that have changed, where the storage format allows it
+    if storage == "sqlite":
+        savesqlite(data, datapath, competitionkey(country, comp), seasons)
+    else:
+        STORAGE[storage][1](data, storedcompetition(country, comp, datapath, storage), seasons)
@@ -0,0 +1,156 @@
+import contextlib
+import json
+import re
+import unicodedata
+from os import getpid, path, replace
+
+import numpy as np
+import pandas as pd
+
+# file locks differ between platforms, windows only has msvcrt
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# markers the results pages add to team names for extra time, penalty shootouts and neutral grounds
+MARKERS = ["[ET]", "[PS]", "[N]"]
+
+
+def cleanname(name):
+    # the name as it should be shown, without markers, odd unicode forms or doubled spaces
+    for marker in MARKERS:
+        name = name.replace(marker, "")
+    return " ".join(unicodedata.normalize("NFKC", name).split())
+
+
+def namekey(name):
+    # what names are matched on, so "St. Mirren" and "st mirren" are the same team
+    return " ".join(re.sub(r"[.'`]", "", cleanname(name)).casefold().split())
+
+
+@contextlib.contextmanager
+def filelock(filename):
+    # only one process at a time gets past this for the same file, the others wait their turn
+    with open(filename + ".lock", "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class TeamRegistry:
+    # every team we've seen in any season or competition, each with an id that never changes once given out
+    # other spellings can be added as aliases, they get the same id and are stored under the first name we saw
+    # updates of different competitions share the file, so new teams are written straight away under a lock
+    # after reading what the others have added, two processes never give the same id to different teams
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.names = []
+        self.ids = {}
+        if filename is not None:
+            self.read()
+
+    def read(self):
+        if self.filename is None or not path.isfile(self.filename):
+            return
+        with open(self.filename) as f:
+            saved = json.load(f)
+        self.names = saved["names"]
+        self.ids = {namekey(name): i for i, name in enumerate(self.names)}
+        self.ids.update((namekey(alias), i) for alias, i in saved["aliases"].items())
+
+    def write(self):
+        # written to a file of our own then moved into place, so other processes never see a half written file
+        aliases = {key: i for key, i in self.ids.items() if key != namekey(self.names[i])}
+        temporary = self.filename + "." + str(getpid()) + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump({"names": self.names, "aliases": aliases}, f, indent=1)
+        replace(temporary, self.filename)
+
+    def update(self, change):
+        # make a change on top of the latest saved registry, without a file it's just made in memory
+        if self.filename is None:
+            change()
+            return
+        with filelock(self.filename):
+            self.read()
+            change()
+            self.write()
+
+    def newnames(self, names):
+        for name in names:
+            key = namekey(name)
+            if key not in self.ids:
+                self.ids[key] = len(self.names)
+                self.names.append(cleanname(name))
+
+    def addnames(self, names):
+        # give ids to any of the names that don't have one yet, another process may have just added some of them
+        if any(namekey(name) not in self.ids for name in names):
+            self.update(lambda: self.newnames(names))
+
+    def teamid(self, name):
+        self.addnames([name])
+        return self.ids[namekey(name)]
+
+    def addalias(self, alias, name):
+        # alias is another spelling of name, games already stored under the alias keep their old id until reloaded
+        def change():
+            self.newnames([name])
+            self.ids[namekey(alias)] = self.ids[namekey(name)]
+
+        self.update(change)
+
+    def encode(self, names):
+        # ids for a whole column of names, each different name is only looked up once
+        codes, uniques = pd.factorize(pd.Series(names).astype(str).values)
+        self.addnames(uniques)
+        ids = np.array([self.ids[namekey(name)] for name in uniques], dtype=np.int32)
+        return ids[codes]
+
+    def decode(self, ids):
+        return np.asarray(self.names, dtype=object)[np.asarray(ids)]
+
+
+def openregistry(datapath):
+    # one registry is shared by every competition in a data folder
+    return TeamRegistry(path.join(datapath, "teams.json"))
+
+
+def addteamids(df, registry):
+    # store teams under their registered names, with int32 id columns that every per-team sum can use directly
+    homeids = registry.encode(df["homeTeam"].values)
+    awayids = registry.encode(df["awayTeam"].values)
+    df["homeTeam"] = pd.Categorical(registry.decode(homeids))
+    df["awayTeam"] = pd.Categorical(registry.decode(awayids))
+    df["homeTeamId"] = homeids
+    df["awayTeamId"] = awayids
+    return df
+
+
+def teamcodes(df):
+    # the teams in the games, sorted by name, and the position of each game's home and away team in that list
+    # uses the id columns when there are some, so the work is on integers rather than comparing names
+    # ids that aren't integers have gaps, games saved before teams had ids, so the names are used instead
+    if all(column in df and df[column].dtype.kind in "iu" for column in ["homeTeamId", "awayTeamId"]):
+        homeids = df["homeTeamId"].values
+        awayids = df["awayTeamId"].values
+        ids, first = np.unique(np.concatenate((homeids, awayids)), return_index=True)
+        names = np.concatenate((df["homeTeam"].astype(str).values, df["awayTeam"].astype(str).values))[first]
+        order = np.argsort(names, kind="mergesort")
+        positions = np.empty(len(ids), dtype=np.intp)
+        positions[order] = np.arange(len(ids))
+        return (pd.Index(names[order]), positions[np.searchsorted(ids, homeids)],
+                positions[np.searchsorted(ids, awayids)])
+
+    teams = pd.Index(sorted(set(df["homeTeam"].astype(str)) | set(df["awayTeam"].astype(str))))
+    return teams, teams.get_indexer(df["homeTeam"].astype(str)), teams.get_indexer(df["awayTeam"].astype(str))